@@ -0,0 +1,30 @@
+"""
+Compare the serial and the parallel decoding (see RADAR_DECODE_WORKERS)
+of a full WN run of 25 synthetic 900x900 frames.
+
+    python -m benchmarks.bench_decode
+"""
+import os
+import time
+from datetime import datetime
+from benchmarks.reference import make_frame
+from utils.ingest import process_radar_data
+
+
+def main(number=5, nframes=25):
+    run = datetime(2024, 1, 16, 12, 0)
+    members = [
+        ("WN2401161200_%03d" % (i * 5), make_frame(run, i * 5, 900, 900))
+        for i in range(nframes)
+    ]
+    print(f"{os.cpu_count()} CPUs")
+    for workers in (0, 2, 4):
+        start = time.perf_counter()
+        for _ in range(number):
+            process_radar_data(iter(members), workers=workers)
+        elapsed = (time.perf_counter() - start) / number
+        print(f"workers={workers}: {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Compare the extraction of the rain rate along long routes with the
+vectorized gather of extract_rain_rate_from_radar and with the loop over
+shifts and points it replaced (both map the points to the grid cells with
+the projection, so only the extraction is compared).
+
+    python -m benchmarks.bench_extraction
+"""
+import timeit
+import numpy as np
+import pandas as pd
+from benchmarks.reference import extract_with_loop
+from utils.projection import nearest_cell
+from utils.utils import extract_rain_rate_from_radar
+
+
+def main(number=5):
+    rng = np.random.default_rng(0)
+    time_radar = pd.date_range("2024-01-16 12:00", periods=25, freq="5min")
+    dtime_radar = time_radar - time_radar[0]
+    rr = rng.integers(0, 1200, (25, 900, 900)).astype(np.uint16)
+
+    for npoints in (1000, 5000, 20000):
+        lon = 9 + np.cumsum(rng.normal(0, 0.0005, npoints))
+        lat = 50 + np.cumsum(rng.normal(0, 0.0005, npoints))
+        seconds = np.linspace(0, 7200, npoints)
+        dtime = pd.Series(pd.to_timedelta(seconds, unit="s"))
+        args = (lon, lat, dtime, time_radar, dtime_radar, rr)
+
+        def loop_extraction():
+            rows, cols = nearest_cell(lon, lat, *rr.shape[1:])
+            inds_latlon_radar = np.ravel_multi_index((rows, cols), rr.shape[1:])
+            return extract_with_loop(
+                inds_latlon_radar, dtime, time_radar, dtime_radar, rr
+            )
+
+        loop = timeit.timeit(loop_extraction, number=number) / number
+        gather = (
+            timeit.timeit(lambda: extract_rain_rate_from_radar(*args), number=number)
+            / number
+        )
+        print(
+            f"route of {npoints} points: loop {loop * 1e3:.1f} ms, "
+            f"gather {gather * 1e3:.1f} ms ({loop / gather:.0f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
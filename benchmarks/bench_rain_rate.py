@@ -0,0 +1,28 @@
+"""
+Compare the conversion of raw counts to mm/h through RAIN_RATE_LUT with
+the direct formula, on a whole frame and on the time series of one cell.
+
+    python -m benchmarks.bench_rain_rate
+"""
+import timeit
+import numpy as np
+from utils.radolan import RAW_NODATA, RAW_PRECISION, raw_to_rain_rate, to_rain_rate
+
+
+def main(number=50):
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 6000, (900, 900)).astype(np.uint16)
+    frame[rng.random(frame.shape) < 0.02] = RAW_NODATA
+    series = frame[:25, 0].copy()
+
+    for name, raw in (("frame 900x900", frame), ("series of 25", series)):
+        lut = timeit.timeit(lambda: raw_to_rain_rate(raw), number=number) / number
+        formula = (
+            timeit.timeit(lambda: to_rain_rate(raw * RAW_PRECISION), number=number)
+            / number
+        )
+        print(f"{name}: formula {formula * 1e6:.1f} us, LUT {lut * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
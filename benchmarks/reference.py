@@ -0,0 +1,52 @@
+"""
+Reference implementations and synthetic data shared by the benchmarks and
+the tests: the loop extraction replaced by extract_rain_rate_from_radar and
+a factory of RADOLAN WN files.
+"""
+import numpy as np
+from utils.radolan import raw_to_rain_rate
+from utils.settings import shifts
+from utils.utils import convert_to_dataframe
+
+
+def extract_with_loop(inds_latlon_radar, dtime_bike, time_radar, dtime_radar, rr):
+    """
+    The extraction with a loop over shifts and points, given the flat index
+    of the radar cell closest to every point of the bike track
+    """
+    rr = rr.reshape(rr.shape[0], -1)
+    inds_dtime_radar = np.abs(
+        np.subtract.outer(dtime_radar.values, dtime_bike.values)
+    ).argmin(0)
+    rain_bike = np.empty(shape=(len(shifts), len(inds_latlon_radar)))
+    for i, shift in enumerate(shifts):
+        temp = []
+        for i_time, i_space in zip(inds_dtime_radar, inds_latlon_radar):
+            if i_time + shift < rr.shape[0]:
+                temp.append(rr[i_time + shift][i_space])
+            else:
+                temp.append(np.nan)
+        rain_bike[i, :] = temp
+    id_radar_data = inds_latlon_radar + inds_dtime_radar
+    shifted = np.append(id_radar_data[1:], -1)
+    rain_bike = rain_bike[:, id_radar_data != shifted]
+    dtime_bike = dtime_bike[id_radar_data != shifted]
+
+    return convert_to_dataframe(raw_to_rain_rate(rain_bike), dtime_bike, time_radar)
+
+
+def make_frame(run, minute, nrow=90, ncol=90):
+    """Content of a RADOLAN WN file of run (a datetime) with random counts"""
+    rng = np.random.default_rng(minute)
+    body = "PR E-01INT   5GP%4dx%4dVV %03dMF 00000008QN 016MS 10<boo,ros>" % (
+        nrow,
+        ncol,
+        minute,
+    )
+    prefix = "WN" + run.strftime("%d%H%M") + "10000" + run.strftime("%m%y")
+    size = nrow * ncol * 2
+    header_length = len(prefix) + 9 + len(body)
+    header = prefix + "BY%7d" % (header_length + 1 + size) + body
+    data = rng.integers(0, 1200, nrow * ncol).astype("<u2")
+
+    return header.encode() + b"\x03" + data.tobytes()
@@ -1,17 +1,38 @@
-import numpy as np
+import json
 import pandas as pd
+import numpy as np
 import time
-from flask import request, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from flask import request, jsonify, current_app
 from main import server
 from utils.utils import (
     get_directions,
     get_data,
     get_place_address,
-    distance_km,
-    to_rain_rate,
+    nearest_cell,
+    on_grid,
+    raw_to_rain_rate,
     get_radar_data,
+    extract_rain_rate_at_points,
+    extract_rain_rate_batch,
+    route_from_geometry,
+    get_radar_run,
+    get_radar_rainy,
+    rainy_frames_between,
 )
-from utils.settings import URL_BASE_PATHNAME, logging
+from utils.settings import URL_BASE_PATHNAME, ROUTING_WORKERS, logging
+
+# Time windows (from the first radar frame, both ends included)
+# checked for rain by pointsummary
+POINT_SUMMARY_WINDOWS = {
+    "rain_now": ("0 min", "5 min"),
+    "rain_in_15min": ("15 min", "30 min"),
+    "rain_in_30min": ("30 min", "45 min"),
+    "rain_in_45min": ("45 min", "60 min"),
+    "rain_in_60min": ("60 min", "90 min"),
+    "rain_in_90min": ("90 min", "120 min"),
+    "rain_in_120min": ("110 min", "120 min"),
+}
 
 
 @server.route(f"/{URL_BASE_PATHNAME}/ridequery", methods=["GET", "POST"])
@@ -53,10 +74,9 @@ def pointquery():
         logging.info(f"Making request to pointquery with point_address={point_address}")
         place_name, place_center = get_place_address(point_address, limit=1)
         lon, lat = place_center
-        lon_radar, lat_radar, time_radar, _, rr = get_radar_data()
-        dist = distance_km(lon_radar, lon, lat_radar, lat)
-        min_indices = np.unravel_index(dist.argmin(), dist.shape)
-        rain_time = to_rain_rate(rr[:, min_indices[0], min_indices[1]])
+        _, _, time_radar, _, rr = get_radar_data()
+        row, col = nearest_cell(lon, lat, *rr.shape[1:])
+        rain_time = raw_to_rain_rate(rr[:, row, col])
 
         out = pd.DataFrame({"time": time_radar, "rain": rain_time})
         out = out.to_json(orient="records", date_format="iso")
@@ -79,94 +99,19 @@ def pointsummary():
         start_time = time.perf_counter()
         place_name, place_center = get_place_address(point_address, limit=1)
         lon, lat = place_center
-        lon_radar, lat_radar, time_radar, _, rr = get_radar_data()
-        dist = distance_km(lon_radar, lon, lat_radar, lat)
-        min_indices = np.unravel_index(dist.argmin(), dist.shape)
-        rain_time = to_rain_rate(rr[:, min_indices[0], min_indices[1]])
+        run = get_radar_run()
+        _, _, time_radar, dtime_radar, rr = get_radar_data(run)
+        row, col = nearest_cell(lon, lat, *rr.shape[1:])
+        rainy = get_radar_rainy(run, rr, row, col)
 
-        out = pd.DataFrame({"time": time_radar, "rain": rain_time})
         resp = {}
         resp["place"] = place_name
         resp["place_coordinates"] = str(place_center)
         # Consider rain in the next 5 mins
-        resp["now"] = out.time[0].isoformat()
-        resp["rain_now"] = (
-            (
-                out[
-                    (out.time >= out.time[0])
-                    & (out.time <= out.time[0] + pd.to_timedelta("5 min"))
-                ].rain.sum()
-                > 0
-            )
-            .astype(int)
-            .astype(str)
-        )
-        resp["rain_in_15min"] = (
-            (
-                out[
-                    (out.time >= out.time[0] + pd.to_timedelta("15 min"))
-                    & (out.time <= out.time[0] + pd.to_timedelta("30 min"))
-                ].rain.sum()
-                > 0
-            )
-            .astype(int)
-            .astype(str)
-        )
-        resp["rain_in_30min"] = (
-            (
-                out[
-                    (out.time >= out.time[0] + pd.to_timedelta("30 min"))
-                    & (out.time <= out.time[0] + pd.to_timedelta("45 min"))
-                ].rain.sum()
-                > 0
-            )
-            .astype(int)
-            .astype(str)
-        )
-        resp["rain_in_45min"] = (
-            (
-                out[
-                    (out.time >= out.time[0] + pd.to_timedelta("45 min"))
-                    & (out.time <= out.time[0] + pd.to_timedelta("60 min"))
-                ].rain.sum()
-                > 0
-            )
-            .astype(int)
-            .astype(str)
-        )
-        resp["rain_in_60min"] = (
-            (
-                out[
-                    (out.time >= out.time[0] + pd.to_timedelta("60 min"))
-                    & (out.time <= out.time[0] + pd.to_timedelta("90 min"))
-                ].rain.sum()
-                > 0
-            )
-            .astype(int)
-            .astype(str)
-        )
-        resp["rain_in_90min"] = (
-            (
-                out[
-                    (out.time >= out.time[0] + pd.to_timedelta("90 min"))
-                    & (out.time <= out.time[0] + pd.to_timedelta("120 min"))
-                ].rain.sum()
-                > 0
-            )
-            .astype(int)
-            .astype(str)
-        )
-        resp["rain_in_120min"] = (
-            (
-                out[
-                    (out.time >= out.time[0] + pd.to_timedelta("110 min"))
-                    & (out.time <= out.time[0] + pd.to_timedelta("120 min"))
-                ].rain.sum()
-                > 0
-            )
-            .astype(int)
-            .astype(str)
-        )
+        resp["now"] = time_radar[0].isoformat()
+        for name, (start, end) in POINT_SUMMARY_WINDOWS.items():
+            frames = rainy_frames_between(dtime_radar, rainy, start, end)
+            resp[name] = str(int(frames > 0))
         end_time = time.perf_counter()
         total_time = end_time - start_time
         logging.info(
@@ -176,3 +121,153 @@ def pointsummary():
         return resp
     else:
         return None
+
+
+def parse_point(item):
+    """
+    Get (id, place, lon, lat) of an item of a batch request, either
+    {"lat": .., "lon": ..} or {"address": ..} (or directly the address),
+    with an optional "id". Raises ValueError if it cannot be resolved
+    or the coordinates are not finite.
+    """
+    if isinstance(item, str):
+        item = {"address": item}
+    if not isinstance(item, dict):
+        raise ValueError(f"Invalid point {item!r}")
+    if "lat" in item and "lon" in item:
+        place, lon, lat = None, float(item["lon"]), float(item["lat"])
+    elif item.get("address"):
+        place, place_center = get_place_address(item["address"], limit=1)
+        if place_center is None:
+            raise ValueError(f"Address {item['address']!r} not found")
+        lon, lat = place_center
+    else:
+        raise ValueError(f"Invalid point {item!r}")
+    if not (np.isfinite(lon) and np.isfinite(lat)):
+        raise ValueError(f"Invalid coordinates of point {item!r}")
+
+    return item.get("id"), place, lon, lat
+
+
+@server.route(f"/{URL_BASE_PATHNAME}/pointbatch", methods=["POST"])
+def pointbatch():
+    """
+    Rain rate time series for many points at once. The body is a JSON array
+    of {"lat": .., "lon": ..} or {"address": ..} objects (or addresses),
+    all the cells are looked up and gathered from the radar data at once.
+    A point which cannot be resolved or is outside of the radar coverage
+    gets an {"id": .., "error": ..} entry instead, the others are answered.
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or len(items) == 0:
+        return jsonify({"error": "Expected a non-empty JSON array of points"}), 400
+
+    start_time = time.perf_counter()
+    _, _, time_radar, _, rr = get_radar_data()
+    out, points = [], {}
+    for i, item in enumerate(items):
+        point_id = item.get("id") if isinstance(item, dict) else None
+        if point_id is None:
+            point_id = i
+        try:
+            _, place, lon, lat = parse_point(item)
+            if not on_grid(lon, lat, *rr.shape[1:]):
+                raise ValueError(f"Point {item!r} is outside of the radar coverage")
+        except Exception as e:
+            out.append({"id": point_id, "error": f"{type(e).__name__}: {e}"})
+            continue
+        points[i] = (place, lon, lat)
+        out.append({"id": point_id, "place": place, "lon": lon, "lat": lat})
+
+    if points:
+        _, lons, lats = zip(*points.values())
+        rain = extract_rain_rate_at_points(np.array(lons), np.array(lats), rr)
+        for i, rain_point in zip(points, rain):
+            out[i]["rain"] = rain_point.tolist()
+
+    end_time = time.perf_counter()
+    total_time = end_time - start_time
+    logging.info(
+        f"Making request to pointbatch with {len(items)} points took {total_time:.2f} seconds"
+    )
+
+    return jsonify({"time": [t.isoformat() for t in time_radar], "points": out})
+
+
+def parse_route(app, item, grid_shape):
+    """
+    Get (source, dest, lons, lats, dtime, meta) of an item of a batch
+    request: {"from": .., "to": .., "mode": ..} with addresses or [lon, lat]
+    coordinates, or {"geometry": [[lon, lat], ..], "durations": [..]} with
+    the optional seconds elapsed at every point, which must be finite and
+    within the radar grid of shape grid_shape.
+    Runs in a worker thread, so it needs the app context for the cache.
+    """
+    with app.app_context():
+        if "geometry" in item:
+            geometry = item["geometry"]
+            if isinstance(geometry, dict):
+                geometry = geometry["coordinates"]
+            lons, lats, dtime = route_from_geometry(
+                geometry, item.get("durations"), grid_shape=grid_shape
+            )
+            return None, None, lons, lats, dtime, {}
+        if item.get("from") and item.get("to"):
+            return get_directions(item["from"], item["to"], item.get("mode") or "cycling")
+        raise ValueError(f"Invalid route {item!r}")
+
+
+@server.route(f"/{URL_BASE_PATHNAME}/ridebatch", methods=["POST"])
+def ridebatch():
+    """
+    Rain forecast along many routes at once. The body is a JSON array of
+    routes (see parse_route), each with an optional "id" (by default its
+    position in the array), which must be unique. The directions
+    are requested concurrently, then the rain is extracted for all the
+    routes at once from the same radar data.
+    The response is a JSON object with one entry per route id.
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or len(items) == 0:
+        return jsonify({"error": "Expected a non-empty JSON array of routes"}), 400
+    if not all(isinstance(item, dict) for item in items):
+        return jsonify({"error": "Every route must be a JSON object"}), 400
+
+    ids = [str(item.get("id", i)) for i, item in enumerate(items)]
+    duplicates = sorted({route_id for route_id in ids if ids.count(route_id) > 1})
+    if duplicates:
+        return jsonify({"error": f"Duplicate route ids {duplicates}"}), 400
+
+    start_time = time.perf_counter()
+    _, _, time_radar, dtime_radar, rr = get_radar_data()
+    app = current_app._get_current_object()
+    with ThreadPoolExecutor(max_workers=ROUTING_WORKERS) as executor:
+        futures = [
+            executor.submit(parse_route, app, item, rr.shape[1:]) for item in items
+        ]
+
+    out, routes, directions = {}, {}, {}
+    for route_id, future in zip(ids, futures):
+        try:
+            source, dest, lons, lats, dtime, meta = future.result()
+        except Exception as e:
+            out[route_id] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        routes[route_id] = (lons, lats, dtime)
+        directions[route_id] = {"source": source, "dest": dest, "meta": meta}
+
+    if routes:
+        data = extract_rain_rate_batch(routes, time_radar, dtime_radar, rr)
+        for route_id, df in data.items():
+            out[route_id] = {
+                **directions[route_id],
+                "data": json.loads(df.to_json(orient="records", date_format="iso")),
+            }
+    end_time = time.perf_counter()
+    total_time = end_time - start_time
+    logging.info(
+        f"Making request to ridebatch with {len(items)} routes took {total_time:.2f} seconds"
+    )
+
+    return jsonify({route_id: out[route_id] for route_id in ids})
+
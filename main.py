@@ -16,7 +16,8 @@ from dash import (
     page_registry,
 )
 from dash.exceptions import PreventUpdate
-from utils.settings import cache, URL_BASE_PATHNAME
+from utils.settings import cache, URL_BASE_PATHNAME, CACHE_STARTUP
+from utils.utils import warm_up
 from utils.rainviewer_api import get_radar_latest_tile_url
 from components import navbar, footer
 
@@ -34,9 +35,13 @@ server = app.server
 
 # Initialize cache
 cache.init_app(server)
-# Clear cache at app initialization
-with server.app_context():
-    cache.clear()
+if CACHE_STARTUP == "clear":
+    with server.app_context():
+        cache.clear()
+else:
+    # Keep what the other workers already cached and load the radar data
+    # before accepting requests
+    warm_up()
 
 
 def serve_layout():
@@ -3,15 +3,14 @@ from utils.utils import (
     get_place_address_reverse,
     get_place_address,
     get_radar_data,
-    distance_km,
-    to_rain_rate,
+    nearest_cell,
+    raw_to_rain_rate,
 )
 from utils.openmeteo_api import get_forecast_data
 from utils.rainviewer_api import get_forecast as get_forecast_rainviewer
 from utils.rainbow_weather_api import RainbowAI
 from utils.settings import logging
 from dash.exceptions import PreventUpdate
-import numpy as np
 import dash_leaflet as dl
 import plotly.graph_objects as go
 import pandas as pd
@@ -135,10 +134,9 @@ def create_figure(data):
 
     # RADOLAN trace
     try:
-        lon_radar, lat_radar, time_radar, _, rr = get_radar_data()
-        dist = distance_km(lon_radar, data["lon"], lat_radar, data["lat"])
-        min_indices = np.unravel_index(dist.argmin(), dist.shape)
-        rain_time = to_rain_rate(rr[:, min_indices[0], min_indices[1]])
+        _, _, time_radar, _, rr = get_radar_data()
+        row, col = nearest_cell(data["lon"], data["lat"], *rr.shape[1:])
+        rain_time = raw_to_rain_rate(rr[:, row, col])
         fig.add_trace(go.Scatter(
             x=time_radar,
             y=rain_time,
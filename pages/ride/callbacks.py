@@ -15,6 +15,7 @@ from utils.utils import (
     make_fig_bars,
     get_place_address_reverse,
     get_data,
+    get_departures,
     get_radar_data,
     get_directions,
     get_place_address,
@@ -233,7 +234,14 @@ def create_figure(data, switch):
                         False,
                     )
                 else:
-                    min_time = out.sum().idxmin().strftime("%H:%M:%S")
+                    # Best among all the departures, not only the plotted ones,
+                    # unless the ride is longer than the radar forecast
+                    departures = get_departures(df.lons, df.lats, df.dtime)
+                    if departures.empty:
+                        best = out.sum().idxmin()
+                    else:
+                        best = departures["total"].idxmin()
+                    min_time = best.strftime("%H:%M:%S")
                     if switch == ["time_series"]:
                         return make_fig_time(out), min_time, None, False
                     else:
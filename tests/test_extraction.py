@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_allclose
+from benchmarks.reference import extract_with_loop
+from utils.radolan import get_latlon_radar
+from utils.utils import extract_rain_rate_from_radar, route_from_geometry
+
+
+def make_route(rng, npoints=400):
+    """Random ride of npoints points over Germany, up to about 2 hours long"""
+    lon = 7 + 6 * rng.random() + np.cumsum(rng.normal(0, 0.002, npoints))
+    lat = 48 + 5 * rng.random() + np.cumsum(rng.normal(0, 0.002, npoints))
+    seconds = np.insert(np.cumsum(rng.integers(5, 20, npoints - 1)), 0, 0)
+    dtime = pd.Series(pd.to_timedelta(seconds, unit="s"))
+
+    return lon, lat, dtime
+
+
+def test_extraction_matches_loop():
+    BallTree = pytest.importorskip("sklearn.neighbors").BallTree
+    rng = np.random.default_rng(0)
+    time_radar = pd.date_range("2024-01-16 12:00", periods=25, freq="5min")
+    dtime_radar = time_radar - time_radar[0]
+    rr = rng.integers(0, 1200, (25, 900, 900)).astype(np.uint16)
+    lon_radar, lat_radar = get_latlon_radar()
+    tree = BallTree(
+        np.deg2rad(np.dstack([lat_radar.ravel(), lon_radar.ravel()])[0]),
+        metric="haversine",
+    )
+
+    for _ in range(20):
+        lon, lat, dtime = make_route(rng)
+        inds_latlon_radar = tree.query(
+            np.deg2rad(np.vstack([lat, lon]).T), return_distance=False
+        ).ravel()
+        expected = extract_with_loop(
+            inds_latlon_radar, dtime, time_radar, dtime_radar, rr
+        )
+        df = extract_rain_rate_from_radar(lon, lat, dtime, time_radar, dtime_radar, rr)
+        assert (df.index == expected.index).all()
+        assert (df.columns == expected.columns).all()
+        assert_allclose(df.values, expected.values, equal_nan=True)
+
+
+@pytest.mark.parametrize(
+    "geometry, durations",
+    [
+        ([[9.0, 50.0], [np.nan, 50.1]], None),
+        ([[-70.0, 40.0], [-70.1, 40.1]], None),
+        ([[9.0, 50.0], [9.1, 50.1]], [0, np.inf]),
+    ],
+)
+def test_route_from_geometry_rejects_invalid(geometry, durations):
+    with pytest.raises(ValueError):
+        route_from_geometry(geometry, durations)
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+from utils import radar_store
+from utils.ingest import convert_timezone
+
+
+def make_run(start, value, nframes=25):
+    """Constant cube of a run starting at start and the times (UTC) of its frames"""
+    time_radar = pd.date_range(start, periods=nframes, freq="5min")
+    rr = np.full((nframes, 4, 4), value, dtype=np.uint16)
+
+    return rr, time_radar
+
+
+def test_runs_across_the_end_of_dst(tmp_path):
+    # 00:30 and 01:30 UTC are both 02:30 in Berlin on the night DST ends
+    first = make_run("2026-10-25 00:30", 0)
+    second = make_run("2026-10-25 01:30", 1)
+    assert convert_timezone(first[1])[0] == convert_timezone(second[1])[0]
+
+    run_first = radar_store.publish_snapshot(*first, store_dir=tmp_path)
+    run_second = radar_store.publish_snapshot(*second, store_dir=tmp_path)
+    assert run_first == "202610250030"
+    assert run_second == "202610250130"
+
+    assert radar_store.get_latest_run(tmp_path) == run_second
+    assert radar_store.list_snapshots(tmp_path) == [run_first, run_second]
+    time_radar, rr = radar_store.load_snapshot(store_dir=tmp_path)
+    assert rr.max() == 1
+    assert (time_radar == second[1]).all()
+
+
+def test_older_run_does_not_replace_latest(tmp_path):
+    run_new = radar_store.publish_snapshot(
+        *make_run("2026-10-25 01:00", 1), store_dir=tmp_path
+    )
+    radar_store.publish_snapshot(*make_run("2026-10-25 00:55", 0), store_dir=tmp_path)
+
+    assert radar_store.get_latest_run(tmp_path) == run_new
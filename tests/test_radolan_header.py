@@ -0,0 +1,49 @@
+import pytest
+from utils.radolan import (
+    get_radolan_header_token_values,
+    parse_dwd_composite_header,
+    radolan_header_token,
+)
+
+HEADERS = {
+    "RW": "RW030950100000416BY1620140VS 3SW   2.18.3PR E-01INT  60GP 900x 900"
+    "MS 58<boo,ros,emd,hnr,umd,pro,ess,asd,neu,nhb,oft,tur,isn,fbg,mem>",
+    "RQ": "RQ081935100000619BY1620142VS 3SW P300001PR E-01INT  60GP 900x 900"
+    "VV 090MF 00000002QN 001MS 67<boo,ros,emd,hnr,umd,pro,ess,asd,neu,nhb,"
+    "oft,tur,isn,fbg,mem>",
+    "WN": "WN121155100000919BY2640080VS 5SW P100001PR E-01INT   5GP1200x1100"
+    "VV 120MF 00000008QN 016MS 67<asb,boo,ros,hnr,umd,pro,ess,fld,drs,neu,nhb,"
+    "oft,eis,tur,isn,fbg,mem>",
+}
+
+
+def get_radolan_header_token_pos(header):
+    """The parser replaced by get_radolan_header_token_values: the last
+    occurrence of every token, with its value up to the next token found"""
+    positions = {}
+    for token in radolan_header_token:
+        d = header.rfind(token)
+        if d > -1:
+            positions[token] = d
+    head = {}
+    for k, v in positions.items():
+        following = [x for x in positions.values() if x > v]
+        head[k] = (v + len(k), min(following) if following else len(header))
+
+    return head
+
+
+@pytest.mark.parametrize("product", HEADERS)
+def test_token_values_match_old_parser(product):
+    header = HEADERS[product]
+    expected = {
+        k: header[start:stop]
+        for k, (start, stop) in get_radolan_header_token_pos(header).items()
+    }
+
+    assert get_radolan_header_token_values(header) == expected
+
+
+def test_version_with_upper_case_letters():
+    assert parse_dwd_composite_header(HEADERS["RQ"])["radolanversion"] == "P300001"
+    assert parse_dwd_composite_header(HEADERS["WN"])["nrow"] == 1200
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_allclose
+from utils.radolan import (
+    RAIN_RATE_LUT,
+    RAW_NODATA,
+    RAW_PRECISION,
+    raw_to_rain_rate,
+    raw_to_rainy_count,
+    to_rain_rate,
+)
+from utils.ingest import convert_timezone
+from utils.utils import rainy_frames_between
+
+
+def test_lut_matches_formula_on_all_counts():
+    counts = np.arange(RAW_NODATA, dtype=np.uint16)
+    # The LUT is built from count * RAW_PRECISION, the files use their own
+    # precision factor, so only agreement to rounding is expected
+    assert_allclose(
+        raw_to_rain_rate(counts), to_rain_rate(counts * RAW_PRECISION), rtol=1e-12
+    )
+
+
+def test_nodata_is_no_rain():
+    assert raw_to_rain_rate(np.array([RAW_NODATA], dtype=np.uint16))[0] == 0
+    assert RAIN_RATE_LUT[RAW_NODATA] == 0
+
+
+def test_float_input_keeps_nan():
+    raw = np.array([np.nan, 0, 2000, RAW_NODATA])
+    rain = raw_to_rain_rate(raw)
+    assert np.isnan(rain[0])
+    assert_allclose(rain[1:], raw_to_rain_rate(raw[1:].astype(np.uint16)))
+
+
+def test_lut_is_read_only():
+    assert not RAIN_RATE_LUT.flags.writeable
+
+
+def test_rainy_count():
+    # Highest count of a WN file (12 bits with precision 0.1), then light rain
+    raw = np.array([4095 * 10, 8000, 0, 10000, RAW_NODATA], dtype=np.uint16)
+    count = raw_to_rainy_count(raw[:, None, None])
+    assert count.dtype == np.uint8
+    assert count[:, 0, 0].tolist() == [0, 1, 2, 2, 3, 3]
+    # Same as the count of a single cell
+    assert (raw_to_rainy_count(raw) == count[:, 0, 0]).all()
+
+
+def test_rainy_frames_between_across_the_end_of_dst():
+    # The run starts at 02:30 CEST, its frames from 03:00 UTC are at 02:00 CET
+    time_utc = pd.date_range("2026-10-25 00:30", periods=25, freq="5min")
+    assert not convert_timezone(time_utc).is_monotonic_increasing
+    raw = np.zeros(25, dtype=np.uint16)
+    raw[[2, 8]] = 10000
+    rainy = raw_to_rainy_count(raw)
+    dtime_radar = time_utc - time_utc[0]
+
+    assert rainy_frames_between(dtime_radar, rainy, "0 min", "5 min") == 0
+    assert rainy_frames_between(dtime_radar, rainy, "10 min", "10 min") == 1
+    assert rainy_frames_between(dtime_radar, rainy, "15 min", "30 min") == 0
+    assert rainy_frames_between(dtime_radar, rainy, "30 min", "45 min") == 1
+    assert rainy_frames_between(dtime_radar, rainy, "0 min", "120 min") == 2
@@ -0,0 +1,202 @@
+import bz2
+import functools
+import io
+import tarfile
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pytest
+import requests
+from benchmarks.reference import make_frame
+from utils import ingest
+from utils.settings import RADAR_CHECK_INTERVAL
+
+ETAG = '"wn-latest"'
+LAST_MODIFIED = "Tue, 16 Jan 2024 12:05:00 GMT"
+
+
+def make_tarball(run, nframes=3):
+    """bz2 compressed tarball of a WN run, like WN_LATEST.tar.bz2"""
+    raw = io.BytesIO()
+    with tarfile.open(fileobj=raw, mode="w") as tar:
+        for i in range(nframes):
+            content = make_frame(run, i * 5)
+            info = tarfile.TarInfo("WN%s_%03d" % (run.strftime("%y%m%d%H%M"), i * 5))
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+    return bz2.compress(raw.getvalue())
+
+
+class RequestLog(list):
+    status = None
+
+
+@pytest.fixture
+def radar_server():
+    """
+    HTTP server of a fixture tarball, recording the headers of every request.
+    Setting requests_seen.status makes it answer with that error instead.
+    """
+    tarball = make_tarball(datetime(2024, 1, 16, 12, 0))
+    requests_seen = RequestLog()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(dict(self.headers))
+            if requests_seen.status is not None:
+                self.send_error(requests_seen.status)
+                return
+            if self.headers.get("If-None-Match") == ETAG:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", ETAG)
+            self.send_header("Last-Modified", LAST_MODIFIED)
+            self.send_header("Content-Length", str(len(tarball)))
+            self.end_headers()
+            self.wfile.write(tarball)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", requests_seen
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Point the refresh to an empty radar store"""
+    for name in (
+        "read_refresh_state",
+        "write_refresh_state",
+        "has_snapshot",
+        "publish_snapshot",
+        "store_lock",
+    ):
+        monkeypatch.setattr(
+            ingest, name, functools.partial(getattr(ingest, name), store_dir=tmp_path)
+        )
+    return tmp_path
+
+
+@pytest.fixture
+def decoded(monkeypatch):
+    """Count the runs decoded by the refresh"""
+    calls = []
+    process_radar_data = ingest.process_radar_data
+
+    def counting_process_radar_data(*args, **kwargs):
+        calls.append(args)
+        return process_radar_data(*args, **kwargs)
+
+    monkeypatch.setattr(ingest, "process_radar_data", counting_process_radar_data)
+    return calls
+
+
+def test_refresh_is_conditional(radar_server, store, decoded):
+    url, requests_seen = radar_server
+
+    # First call: nothing in the store, the run is downloaded and decoded
+    run = ingest.refresh_radar_run(url)
+    assert len(requests_seen) == 1
+    assert "If-None-Match" not in requests_seen[0]
+    assert len(decoded) == 1
+    assert ingest.has_snapshot(run)
+
+    # Not due yet: the server is not asked at all
+    assert ingest.refresh_radar_run(url) == run
+    assert len(requests_seen) == 1
+
+    # Due, but the remote file did not change: conditional request, no decoding
+    state = ingest.read_refresh_state()
+    state["checked"] -= RADAR_CHECK_INTERVAL
+    ingest.write_refresh_state(state)
+    assert ingest.refresh_radar_run(url) == run
+    assert len(requests_seen) == 2
+    assert requests_seen[1]["If-None-Match"] == ETAG
+    assert requests_seen[1]["If-Modified-Since"] == LAST_MODIFIED
+    assert len(decoded) == 1
+    assert ingest.read_refresh_state()["checked"] > state["checked"]
+
+
+def test_failed_refresh_serves_previous_run(radar_server, store):
+    url, requests_seen = radar_server
+    run = ingest.refresh_radar_run(url)
+
+    # The server fails: the previous run is served and the check recorded
+    requests_seen.status = 500
+    state = ingest.read_refresh_state()
+    state["checked"] -= RADAR_CHECK_INTERVAL
+    ingest.write_refresh_state(state)
+    assert ingest.refresh_radar_run(url) == run
+    assert len(requests_seen) == 2
+    assert ingest.read_refresh_state()["checked"] > state["checked"]
+
+    # So it is not asked again before RADAR_CHECK_INTERVAL
+    assert ingest.refresh_radar_run(url) == run
+    assert len(requests_seen) == 2
+
+
+def test_failed_refresh_raises_for_the_ingest(radar_server, store):
+    url, requests_seen = radar_server
+    run = ingest.refresh_radar_run(url)
+
+    requests_seen.status = 500
+    state = ingest.read_refresh_state()
+    state["checked"] -= RADAR_CHECK_INTERVAL
+    ingest.write_refresh_state(state)
+    with pytest.raises(requests.HTTPError):
+        ingest.refresh_radar_run(url, raise_errors=True)
+    # The failed check is recorded, the previous run is still served
+    assert ingest.read_refresh_state()["checked"] > state["checked"]
+    assert ingest.read_refresh_state()["run"] == run
+
+
+def test_failed_first_refresh_raises(radar_server, store):
+    url, requests_seen = radar_server
+    requests_seen.status = 500
+    with pytest.raises(requests.HTTPError):
+        ingest.refresh_radar_run(url)
+
+
+def test_parallel_decoding_matches_serial():
+    run = datetime(2024, 1, 16, 12, 0)
+    members = [
+        ("WN%s_%03d" % (run.strftime("%y%m%d%H%M"), i * 5), make_frame(run, i * 5))
+        for i in range(5)
+    ]
+    time_serial, rr_serial = ingest.process_radar_data(iter(members), workers=0)
+    time_parallel, rr_parallel = ingest.process_radar_data(iter(members), workers=2)
+    assert (time_parallel == time_serial).all()
+    np.testing.assert_array_equal(rr_parallel, rr_serial)
+
+    # More frames than preallocated: the cube grows
+    _, _, rr_grown = ingest.decode_radar_frames_parallel(iter(members), 2, nframes=2)
+    np.testing.assert_array_equal(rr_grown, rr_serial)
+
+
+def test_radar_cube_is_kept_between_calls(radar_server, monkeypatch):
+    url, requests_seen = radar_server
+    monkeypatch.setattr(ingest, "memory_run", {"state": None, "data": None})
+
+    time_radar, rr = ingest.refresh_radar_cube(url)
+    rr[0]
+    assert rr.decoded == 1
+
+    # Not due yet: the same cube, with the frames decoded so far
+    assert ingest.refresh_radar_cube(url)[1] is rr
+    assert len(requests_seen) == 1
+
+    # Due, but the remote file did not change: the cube is kept
+    ingest.memory_run["state"]["checked"] -= RADAR_CHECK_INTERVAL
+    assert ingest.refresh_radar_cube(url)[1] is rr
+    assert len(requests_seen) == 2
+    assert requests_seen[1]["If-None-Match"] == ETAG
+    assert rr.decoded == 1
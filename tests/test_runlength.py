@@ -0,0 +1,57 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+from utils.radolan import decode_radolan_runlength_array
+
+ND = 250
+
+
+def make_line(number, offsets, runs):
+    """PG line: number, offset byte(s), (width, value) runs and lf"""
+    data = bytes((width << 4) | value for width, value in runs)
+
+    return bytes([number]) + bytes(offsets) + data + b"\n"
+
+
+def test_lines_are_decoded_upside_down():
+    binarr = (
+        # offset of 2, runs, then trailing nodata
+        make_line(0, [16 + 2], [(3, 1), (1, 2)])
+        # empty line
+        + b"\x01\n"
+        # no offset, the whole line
+        + make_line(2, [16], [(8, 3)])
+        + b"\x04"
+    )
+    arr = decode_radolan_runlength_array(
+        binarr, {"nrow": 3, "ncol": 8, "nodataflag": ND}
+    )
+
+    assert_array_equal(
+        arr,
+        [
+            [3, 3, 3, 3, 3, 3, 3, 3],
+            [ND, ND, ND, ND, ND, ND, ND, ND],
+            [ND, ND, 1, 1, 1, 2, ND, ND],
+        ],
+    )
+
+
+def test_offset_continues_over_several_bytes_on_a_single_row():
+    # 255 continues the offset with the next byte: (255 - 16) + (46 - 16)
+    binarr = make_line(0, [255, 16 + 30], [(2, 5)]) + b"\x04"
+    arr = decode_radolan_runlength_array(
+        binarr, {"nrow": 1, "ncol": 300, "nodataflag": ND}
+    )
+
+    expected = np.full((1, 300), ND)
+    expected[0, 269:271] = 5
+    assert_array_equal(arr, expected)
+
+
+def test_nodata_flag_not_fitting_uint8():
+    binarr = make_line(0, [16 + 1], [(1, 7)]) + b"\x04"
+    arr = decode_radolan_runlength_array(
+        binarr, {"nrow": 1, "ncol": 3, "nodataflag": -9999}
+    )
+
+    assert_array_equal(arr, [[-9999, 7, -9999]])
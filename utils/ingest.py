@@ -0,0 +1,571 @@
+"""
+Ingest of the RADOLAN WN forecast: poll the DWD opendata server, decode
+every new run and publish it into the radar store, from which the web
+workers only have to load it.
+
+Run it as a standalone process (e.g. with a systemd service) with
+
+    python -m utils.ingest
+
+and set RADAR_INGEST=daemon for the web app, so that requests never
+have to download or decode the data themselves.
+"""
+import argparse
+import bz2
+import io
+import queue
+import re
+import tarfile
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import requests
+from .settings import (
+    RADAR_URL,
+    RADAR_RUN_INTERVAL,
+    RADAR_CHECK_INTERVAL,
+    RADAR_DECODE_WORKERS,
+    RADAR_FRAMES,
+    RADAR_CHUNK_SIZE,
+    RADAR_PREFETCH_CHUNKS,
+    RADAR_BUFFER_SIZE,
+    RADAR_TIMEOUT,
+    radar_dir,
+    logging,
+)
+from .radolan import read_radolan_composite, parse_header, raw_to_rainy_count
+from .radar_cube import RadarCube
+from .radar_store import (
+    publish_snapshot,
+    has_snapshot,
+    read_refresh_state,
+    write_refresh_state,
+    store_lock,
+)
+
+# Serializes the refresh between the threads of a process, store_lock
+# does the same between processes
+refresh_lock = threading.Lock()
+
+
+def convert_timezone(dt_from, from_tz="utc", to_tz="Europe/Berlin"):
+    """
+    Convert between two timezones. dt_from needs to be a Timestamp
+    object, don't know if it works otherwise.
+    """
+    dt_to = dt_from.tz_localize(from_tz).tz_convert(to_tz)
+    # remove again the timezone information
+    return dt_to.tz_localize(None)
+
+
+class BZ2ChunkReader(io.RawIOBase):
+    """
+    Read-only file object which decompresses an iterable of bz2
+    compressed chunks (e.g. a streamed HTTP response) on the fly, so that
+    it can be consumed by tarfile in stream mode without ever having
+    the whole archive in memory or on disk. At most max_length bytes are
+    decompressed at a time, whatever the compression ratio of a chunk.
+    """
+
+    def __init__(self, chunks, max_length=RADAR_BUFFER_SIZE):
+        self._chunks = iter(chunks)
+        self._decompressor = bz2.BZ2Decompressor()
+        self._max_length = max_length
+        self._buffer = memoryview(b"")
+        self._pos = 0
+        # Progress, see iter_radar_members
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos >= len(self._buffer):
+            if self._decompressor.eof:
+                return 0
+            if self._decompressor.needs_input:
+                try:
+                    chunk = next(self._chunks)
+                except StopIteration:
+                    raise EOFError(
+                        "Compressed stream ended before the end-of-stream marker was reached"
+                    )
+                self.compressed_bytes += len(chunk)
+            else:
+                # Output left from the previous chunk
+                chunk = b""
+            self._buffer = memoryview(
+                self._decompressor.decompress(chunk, self._max_length)
+            )
+            self._pos = 0
+            self.decompressed_bytes += len(self._buffer)
+        n = min(len(b), len(self._buffer) - self._pos)
+        b[:n] = self._buffer[self._pos : self._pos + n]
+        self._pos += n
+
+        return n
+
+
+def prefetch_chunks(chunks, maxsize=RADAR_PREFETCH_CHUNKS):
+    """
+    Iterate over chunks (e.g. of a streamed HTTP response) fetched by a
+    background thread up to maxsize chunks ahead, so that the download goes
+    on while the chunks already received are decompressed and decoded.
+    Errors of the download are raised in the consumer.
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def fetch():
+        try:
+            for chunk in chunks:
+                while not stop.is_set():
+                    try:
+                        buffer.put(chunk, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            item = end
+        except Exception as e:
+            item = e
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    thread = threading.Thread(target=fetch, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Let the thread end also when the consumer stops early
+        stop.set()
+
+
+def iter_radar_members(chunks):
+    """
+    Iterate over the members of the (bz2 compressed) radar tarball given as
+    an iterable of compressed chunks and yield (name, content) of every
+    file as soon as it has been decompressed.
+    The time to the first file and the throughput are logged.
+    """
+    start_time = time.perf_counter()
+    first_time = None
+    with BZ2ChunkReader(chunks) as stream, tarfile.open(
+        fileobj=stream, mode="r|"
+    ) as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            content = tar.extractfile(member).read()
+            if first_time is None:
+                first_time = time.perf_counter() - start_time
+                logging.info(f"First radar file received after {first_time:.2f} seconds")
+            yield member.name, content
+        total_time = time.perf_counter() - start_time
+        logging.info(
+            f"Received {stream.compressed_bytes / 1e6:.1f} MB "
+            f"({stream.compressed_bytes / 1e6 / total_time:.1f} MB/s), "
+            f"{stream.decompressed_bytes / 1e6:.1f} MB decompressed, in {total_time:.2f} seconds"
+        )
+
+
+def download_radar_data(base_radar_url=RADAR_URL, validators=None, lazy=False):
+    """
+    Download and decode the latest radar run.
+    The archive is decompressed and extracted while it is downloaded and
+    every file is decoded directly from memory, so nothing is written to disk.
+    If the validators (ETag, Last-Modified) of a previous download are given
+    the request is conditional and nothing is downloaded nor decoded when
+    the remote file did not change. With lazy=True the frames are only
+    decoded when accessed, see process_radar_data.
+    Returns the validators of the remote file and either the time of every
+    frame and the data, or None if the file did not change.
+    """
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    r = requests.get(
+        f"{base_radar_url}/WN_LATEST.tar.bz2",
+        headers=headers,
+        stream=True,
+        timeout=RADAR_TIMEOUT,
+    )
+    with r:
+        remote = {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }
+        if validators and (
+            r.status_code == requests.codes.not_modified
+            # Some servers ignore conditional requests
+            or (remote["etag"] and remote["etag"] == validators.get("etag"))
+            or (
+                remote["last_modified"]
+                and remote["last_modified"] == validators.get("last_modified")
+            )
+        ):
+            return validators, None
+        if r.status_code != requests.codes.ok:
+            r.raise_for_status()
+        chunks = prefetch_chunks(r.iter_content(chunk_size=RADAR_CHUNK_SIZE))
+        return remote, process_radar_data(iter_radar_members(chunks), lazy=lazy)
+
+
+def next_refresh_time(state):
+    """
+    Time (epoch) at which a new radar run can be expected given the state
+    of the last refresh. The data is only updated every RADAR_RUN_INTERVAL
+    seconds, counted from the publication (Last-Modified) of the latest run,
+    and then checked at most every RADAR_CHECK_INTERVAL seconds until the
+    new run is out.
+    """
+    if state.get("last_modified"):
+        published = parsedate_to_datetime(state["last_modified"]).timestamp()
+    else:
+        published = state["checked"]
+
+    return max(
+        published + RADAR_RUN_INTERVAL, state["checked"] + RADAR_CHECK_INTERVAL
+    )
+
+
+def radar_refresh_due(state, now=None):
+    """Check whether a new radar run can be expected, see next_refresh_time"""
+    now = time.time() if now is None else now
+
+    return now >= next_refresh_time(state)
+
+
+def read_valid_refresh_state():
+    """Refresh state of the store, None if its run is not available anymore"""
+    state = read_refresh_state()
+    if state is not None and not has_snapshot(state["run"]):
+        return None
+    return state
+
+
+def refresh_radar_run(base_radar_url=RADAR_URL, raise_errors=False):
+    """
+    Return the id of the latest radar run in the radar store. The remote
+    file is only requested when a new run is expected (see radar_refresh_due)
+    and only downloaded and decoded when it actually changed.
+    The decoded data is published once as a snapshot into the radar
+    store, so that every worker can memory-map the same data.
+
+    Only one caller at a time (across threads and processes) refreshes the
+    store: while it does, the others are served the previous run, or wait
+    for the refresh if there is no previous run yet.
+    If the refresh fails the previous run is served as well and the failed
+    check is recorded, errors are only raised when there is no previous run
+    or with raise_errors=True (e.g. for the ingest to back off).
+    """
+    state = read_valid_refresh_state()
+    if state is not None and not radar_refresh_due(state):
+        return state["run"]
+
+    blocking = state is None
+    if not refresh_lock.acquire(blocking=blocking):
+        return state["run"]
+    try:
+        with store_lock(blocking=blocking) as locked:
+            if not locked:
+                return state["run"]
+            # Someone else may have refreshed while we were waiting
+            state = read_valid_refresh_state()
+            if state is not None and not radar_refresh_due(state):
+                return state["run"]
+            try:
+                return update_radar_run(base_radar_url, state)
+            except Exception as e:
+                if state is None:
+                    raise
+                write_refresh_state({**state, "checked": time.time()})
+                if raise_errors:
+                    raise
+                logging.error(
+                    f"{type(e).__name__} while refreshing radar data, "
+                    f"serving radar run {state['run']}: {e}"
+                )
+                return state["run"]
+    finally:
+        refresh_lock.release()
+
+
+# Latest radar run kept in memory by refresh_radar_cube, without radar store
+memory_run = {"state": None, "data": None}
+
+
+def refresh_radar_cube(base_radar_url=RADAR_URL):
+    """
+    Return the time of every frame and the RadarCube of the latest radar
+    run when there is no radar store. The run is kept in memory by this
+    process, so that the frames decoded for a query are reused by the next
+    ones, and refreshed like the store (see refresh_radar_run): the remote
+    file is only requested when a new run is expected and only downloaded
+    when it changed. While a thread refreshes, or if the refresh fails,
+    the previous run is served.
+    """
+    state = memory_run["state"]
+    if state is not None and not radar_refresh_due(state):
+        return memory_run["data"]
+
+    if not refresh_lock.acquire(blocking=state is None):
+        return memory_run["data"]
+    try:
+        # Someone else may have refreshed while we were waiting
+        state = memory_run["state"]
+        if state is not None and not radar_refresh_due(state):
+            return memory_run["data"]
+        try:
+            validators, data = download_radar_data(
+                base_radar_url, validators=state, lazy=True
+            )
+        except Exception as e:
+            if state is None:
+                raise
+            logging.error(
+                f"{type(e).__name__} while refreshing radar data, "
+                f"serving the previous radar run: {e}"
+            )
+            memory_run["state"] = {**state, "checked": time.time()}
+            return memory_run["data"]
+        if data is not None:
+            memory_run["data"] = data
+        memory_run["state"] = {**validators, "checked": time.time()}
+
+        return memory_run["data"]
+    finally:
+        refresh_lock.release()
+
+
+def get_radar_products(rr):
+    """
+    Products derived once from the cube of a run and published with it:
+    the cumulative count of the frames with rain (see raw_to_rainy_count),
+    to check any time window for rain with two lookups.
+    """
+    return {"rainy": raw_to_rainy_count(rr)}
+
+
+def update_radar_run(base_radar_url, state):
+    """
+    Download the remote file if it changed since the refresh state,
+    publish it and return the id of the latest run.
+    """
+    validators, data = download_radar_data(base_radar_url, validators=state)
+    if data is None:
+        logging.info(f"Radar run {state['run']} is still the latest one")
+        run = state["run"]
+    else:
+        time_radar, rr = data
+        run = publish_snapshot(rr, time_radar, get_radar_products(rr))
+    write_refresh_state(
+        {
+            "run": run,
+            "etag": validators["etag"],
+            "last_modified": validators["last_modified"],
+            "checked": time.time(),
+        }
+    )
+
+    return run
+
+
+def decode_radar_frame(shm_name, shape, index, content):
+    """
+    Decode the radar file content straight into the frame index of the cube
+    living in the shared memory block shm_name, so that only the time stamp
+    of the file has to be sent back to the parent process.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    cube = np.ndarray(shape, dtype=np.uint16, buffer=shm.buf)
+    try:
+        cube[index], rxattrs = read_radolan_composite(content, raw=True)
+    finally:
+        del cube
+        shm.close()
+
+    return rxattrs["datetime"]
+
+
+def allocate_shared_cube(shape):
+    """
+    Cube of uint16 in a new block of shared memory. The block is unmapped
+    once the cube (and every view of it) is gone, but it stays attachable
+    by name only until it is unlinked.
+    Returns the block and the cube.
+    """
+    size = int(np.prod(shape)) * np.dtype(np.uint16).itemsize
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    cube = np.ndarray(shape, dtype=np.uint16, buffer=shm.buf)
+    weakref.finalize(cube, shm.close)
+
+    return shm, cube
+
+
+def decode_radar_frames_parallel(members, workers, nframes=RADAR_FRAMES):
+    """
+    Decode the radar files with a pool of processes. Every file is submitted
+    as soon as it comes out of members, so that decoding overlaps with the
+    download and decompression of the next ones. Every worker writes its
+    frame into its slot of a single cube in shared memory, preallocated for
+    nframes frames, so that no array has to be pickled back nor copied.
+    Returns the name and time stamp of every file and the cube, a view of
+    the shared memory.
+    """
+    fnames = []
+    futures = []
+    shm, cube = None, None
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for fname, content in members:
+                if cube is None:
+                    attrs, _ = parse_header(content)
+                    shm, cube = allocate_shared_cube(
+                        (nframes, attrs["nrow"], attrs["ncol"])
+                    )
+                elif len(fnames) == len(cube):
+                    # More frames than expected: wait for the ones submitted
+                    # and move them to a cube twice as large
+                    for future in futures:
+                        future.exception()
+                    larger_shm, larger = allocate_shared_cube(
+                        (2 * len(cube), *cube.shape[1:])
+                    )
+                    larger[: len(cube)] = cube
+                    shm.unlink()
+                    shm, cube = larger_shm, larger
+                futures.append(
+                    executor.submit(
+                        decode_radar_frame, shm.name, cube.shape, len(fnames), content
+                    )
+                )
+                fnames.append(fname)
+            datetimes = [future.result() for future in futures]
+    finally:
+        # The workers are done with it, the parent keeps its mapping
+        if shm is not None:
+            shm.unlink()
+
+    return fnames, datetimes, cube[: len(fnames)]
+
+
+def process_radar_data(members, workers=RADAR_DECODE_WORKERS, lazy=False):
+    """
+    Take the (name, content) pairs of the radar files and extract the data using
+    the radolan module, which was extracted from wradlib.
+    It also concatenates the files in time and returns
+    the time (UTC) of every frame and a numpy array.
+    With workers > 1 the files are decoded by a pool of processes.
+    With lazy=True only the headers are read and the array is a RadarCube,
+    which decodes every frame on first access.
+    """
+    start_time = time.perf_counter()
+    fnames = []
+    datetimes = []
+    if lazy:
+        contents = []
+        for fname, content in members:
+            rxattrs, _ = parse_header(content)
+            fnames.append(fname)
+            contents.append(content)
+            datetimes.append(rxattrs["datetime"])
+        rr = RadarCube(contents)
+    elif workers > 1:
+        # Parallel decoding only pays off when the frames are not
+        # sent back to this process, see decode_radar_frames_parallel
+        fnames, datetimes, rr = decode_radar_frames_parallel(members, workers)
+    else:
+        data = []
+        for fname, content in members:
+            rxdata, rxattrs = read_radolan_composite(content, raw=True)
+            data.append(rxdata)
+            fnames.append(fname)
+            datetimes.append(rxattrs["datetime"])
+
+        # Conversion to numpy array
+        # !!! The data is kept as compact uint16 counts, where no data is flagged
+        # with RAW_NODATA, and converted to mm/h only on the cells that are needed !!!
+        rr = np.stack(data)
+    logging.info(
+        f"Processing {len(fnames)} radar frames with workers={workers} lazy={lazy} took {time.perf_counter() - start_time:.2f} seconds"
+    )
+
+    time_radar = []
+    for fname, datetime in zip(fnames, datetimes):
+        minute = int(re.findall(r"(?:_)(\d{3})", fname)[0])
+        time_radar.append(datetime + timedelta(minutes=minute))
+    # Kept in UTC, see get_radar_data for the conversion to local time
+    time_radar = pd.to_datetime(time_radar)
+
+    return time_radar, rr
+
+
+def retry_delay(failures):
+    """
+    Seconds to wait before trying again after failures consecutive failed
+    refreshes: RADAR_CHECK_INTERVAL, doubled at every further failure up
+    to RADAR_RUN_INTERVAL, so that an outage of DWD is not hammered.
+    """
+    return min(RADAR_CHECK_INTERVAL * 2 ** (failures - 1), RADAR_RUN_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Poll DWD for new radar runs and publish them into the radar store"
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="refresh the radar store once and exit"
+    )
+    args = parser.parse_args()
+
+    if radar_dir is None:
+        parser.error("No writable cache directory available for the radar store")
+
+    failures = 0
+    while True:
+        try:
+            run = refresh_radar_run(raise_errors=True)
+            logging.info(f"Radar run {run} is published")
+            failures = 0
+        except Exception as e:
+            logging.error(f"{type(e).__name__} while refreshing radar data: {e}")
+            failures += 1
+        if args.once:
+            break
+        state = read_refresh_state()
+        if state is None:
+            wait = RADAR_CHECK_INTERVAL
+        else:
+            wait = next_refresh_time(state) - time.time()
+        if failures:
+            # Back off beyond the next check after the failed refresh
+            wait = max(wait, retry_delay(failures))
+        time.sleep(max(wait, 1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+In-process cache of live Python objects, sitting in front of the shared
+flask_caching filesystem cache. A hit here does not need any disk read or
+unpickling, which matters for the large dataframes/arrays of the routes.
+Entries are evicted by memory footprint (least recently used first) and
+dropped as soon as a new radar run is served.
+"""
+import functools
+import hashlib
+import inspect
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from .settings import cache, MEMORY_CACHE_SIZE
+
+
+def sizeof(value):
+    """Approximate memory footprint (bytes) of a cached value"""
+    if isinstance(value, np.memmap):
+        # Lives in the page cache, not in the process
+        return sys.getsizeof(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, pd.Index):
+        return value.memory_usage(deep=True)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            sizeof(k) + sizeof(v) for k, v in value.items()
+        )
+    return sys.getsizeof(value)
+
+
+class MemoryCache:
+    """
+    Thread-safe LRU cache bounded by the total size (bytes) of its values.
+    Every entry is tagged with the radar run it was computed from, so that
+    all the entries of the previous runs can be dropped at once.
+    """
+
+    def __init__(self, max_size=MEMORY_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.run = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (found, value) for key, marking it as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, size, expires, run = entry
+            if expires is not None and expires < time.monotonic():
+                self._remove(key)
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, timeout=None, run=None):
+        """Store value, evicting the least recently used entries if needed"""
+        size = sizeof(value)
+        if size > self.max_size:
+            return
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires, run)
+            self.size += size
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def set_run(self, run):
+        """Drop all the entries of the radar runs other than run"""
+        with self._lock:
+            if run == self.run:
+                return
+            self.run = run
+            for key in [k for k, e in self._entries.items() if e[3] not in (None, run)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self.size -= size
+
+
+memory_cache = MemoryCache()
+
+
+def make_key(f, args, kwargs):
+    """Key of a call of f: a hash of its name and of its pickled arguments"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{f.__module__}.{f.__qualname__}".encode())
+    h.update(pickle.dumps((args, sorted(kwargs.items())), protocol=5))
+    return h.hexdigest()
+
+
+def memoize(timeout, run_arg=None, key_arg=None):
+    """
+    Like cache.memoize, but with an in-process tier in front of the shared
+    filesystem cache. If run_arg is given, it is the name of the argument
+    holding the radar run id the result depends on: calling the function
+    with a new run drops the in-process entries of the previous runs.
+    If key_arg is given, it is the name of the argument (e.g. a fingerprint)
+    that both tiers use as key, ignoring all the other arguments.
+    """
+
+    def decorator(f):
+        signature = inspect.signature(f)
+        args_to_ignore = None
+        if key_arg is not None:
+            args_to_ignore = [a for a in signature.parameters if a != key_arg]
+        cached_f = cache.memoize(timeout, args_to_ignore=args_to_ignore)(f)
+
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            run = None
+            if run_arg is not None or key_arg is not None:
+                arguments = signature.bind(*args, **kwargs).arguments
+            if run_arg is not None:
+                run = arguments.get(run_arg)
+                memory_cache.set_run(run)
+            if key_arg is not None:
+                key = f"{f.__module__}.{f.__qualname__}:{arguments[key_arg]}"
+            else:
+                key = make_key(f, args, kwargs)
+            found, value = memory_cache.get(key)
+            if found:
+                return value
+            value = cached_f(*args, **kwargs)
+            memory_cache.set(key, value, timeout=timeout, run=run)
+            return value
+
+        decorated_function.uncached = f
+        return decorated_function
+
+    return decorator
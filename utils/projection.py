@@ -0,0 +1,103 @@
+"""
+Polar-stereographic projection of the RADOLAN grid, as described in the
+RADOLAN/RADVOR format description of DWD. This allows to go from lon/lat
+to grid cells (and back) analytically, instead of searching the grid.
+"""
+import numpy as np
+
+# Radius (km) of the spherical earth used by RADOLAN
+EARTH_RADIUS = 6370.04
+# Standard parallel and central meridian (degrees)
+PHI_0 = 60.0
+LAMBDA_0 = 10.0
+# Cartesian coordinates (km) of the lower left corner of the known
+# grids, by (number of rows, number of columns). Grid spacing is 1 km.
+GRID_ORIGINS = {
+    (900, 900): (-523.4622, -4658.645),
+    (1100, 900): (-443.4622, -4758.645),
+    (1200, 1100): (-543.4622, -4808.645),
+    (1500, 1400): (-673.4622, -5008.645),
+}
+
+
+def get_grid_origin(nrow, ncol):
+    """Return the cartesian coordinates (km) of the lower left corner of the grid"""
+    try:
+        return GRID_ORIGINS[(nrow, ncol)]
+    except KeyError:
+        raise ValueError(f"Unknown RADOLAN grid with shape {nrow}x{ncol}")
+
+
+def lonlat_to_xy(lon, lat):
+    """Forward projection from lon/lat (degrees) to cartesian coordinates (km)"""
+    lam = np.deg2rad(np.asarray(lon, dtype=float) - LAMBDA_0)
+    phi = np.deg2rad(np.asarray(lat, dtype=float))
+    m = (1.0 + np.sin(np.deg2rad(PHI_0))) / (1.0 + np.sin(phi))
+    x = EARTH_RADIUS * m * np.cos(phi) * np.sin(lam)
+    y = -EARTH_RADIUS * m * np.cos(phi) * np.cos(lam)
+
+    return x, y
+
+
+def xy_to_lonlat(x, y):
+    """Inverse projection from cartesian coordinates (km) to lon/lat (degrees)"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    c = (EARTH_RADIUS * (1.0 + np.sin(np.deg2rad(PHI_0)))) ** 2
+    rho2 = x**2 + y**2
+    lat = np.rad2deg(np.arcsin((c - rho2) / (c + rho2)))
+    lon = LAMBDA_0 + np.rad2deg(np.arctan2(x, -y))
+
+    return lon, lat
+
+
+def lonlat_to_grid(lon, lat, nrow=900, ncol=900):
+    """
+    Map lon/lat (degrees) to fractional (row, col) on the RADOLAN grid, where
+    integer values correspond to the grid nodes (row 0 is the southernmost).
+    """
+    x_0, y_0 = get_grid_origin(nrow, ncol)
+    x, y = lonlat_to_xy(lon, lat)
+
+    return y - y_0, x - x_0
+
+
+def grid_to_lonlat(row, col, nrow=900, ncol=900):
+    """Map (fractional) (row, col) on the RADOLAN grid to lon/lat (degrees)"""
+    x_0, y_0 = get_grid_origin(nrow, ncol)
+
+    return xy_to_lonlat(np.asarray(col) + x_0, np.asarray(row) + y_0)
+
+
+def on_grid(lon, lat, nrow=900, ncol=900):
+    """Whether lon/lat falls within the cells of the RADOLAN grid"""
+    row, col = lonlat_to_grid(lon, lat, nrow, ncol)
+
+    return (
+        (row >= -0.5) & (row < nrow - 0.5) & (col >= -0.5) & (col < ncol - 0.5)
+    )
+
+
+def nearest_cell(lon, lat, nrow=900, ncol=900):
+    """
+    Return the (row, col) indices of the grid nodes closest to lon/lat.
+    Points outside of the grid are mapped to the closest border cell.
+    """
+    row, col = lonlat_to_grid(lon, lat, nrow, ncol)
+    row = np.clip(np.rint(row), 0, nrow - 1).astype(np.intp)
+    col = np.clip(np.rint(col), 0, ncol - 1).astype(np.intp)
+
+    return row, col
+
+
+def grid_bbox(row, col, nrow=900, ncol=900, margin=0):
+    """
+    Return the bounds (row0, row1, col0, col1), end excluded, of the grid
+    cells (row, col) extended by margin cells, to be used as slices.
+    """
+    return (
+        max(int(np.min(row)) - margin, 0),
+        min(int(np.max(row)) + margin + 1, nrow),
+        max(int(np.min(col)) - margin, 0),
+        min(int(np.max(col)) + margin + 1, ncol),
+    )
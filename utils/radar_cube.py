@@ -0,0 +1,91 @@
+"""
+Radar cube decoded on demand, for when the radar data is used straight from
+a download instead of from the radar store: a query only pays for decoding
+the frames it actually touches.
+"""
+import threading
+import numpy as np
+from .radolan import read_radolan_composite, read_radolan_composite_rows, parse_header
+
+
+class RadarCube:
+    """
+    Cube (time, y, x) of raw counts (see read_radolan_composite) built from
+    the contents of the RADOLAN files of a run. Every frame is decoded the
+    first time it is accessed and then kept, while a range of rows of a
+    frame not decoded yet is read on its own. Supports the numpy indexing
+    used on the decoded cube, where the first index selects the frames, and
+    np.asarray to decode all of them.
+    """
+
+    def __init__(self, contents):
+        self._contents = list(contents)
+        self._frames = [None] * len(self._contents)
+        self._lock = threading.Lock()
+        attrs, _ = parse_header(self._contents[0])
+        self.shape = (len(self._contents), attrs["nrow"], attrs["ncol"])
+        self.dtype = np.dtype(np.uint16)
+        self.ndim = 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def decoded(self):
+        """Number of frames decoded so far"""
+        return sum(frame is not None for frame in self._frames)
+
+    def frame(self, index):
+        """Decoded frame index, decoding it if needed"""
+        frame = self._frames[index]
+        if frame is None:
+            with self._lock:
+                frame = self._frames[index]
+                if frame is None:
+                    frame, _ = read_radolan_composite(self._contents[index], raw=True)
+                    frame.setflags(write=False)
+                    self._frames[index] = frame
+                    # The content is not needed anymore
+                    self._contents[index] = None
+        return frame
+
+    def frame_part(self, index, key):
+        """
+        frame(index)[key], but when the frame is not decoded yet and key
+        starts with a range of rows only these rows are read from the file
+        content (and not kept)
+        """
+        content = self._contents[index]
+        if (
+            content is not None
+            and key
+            and isinstance(key[0], slice)
+            and key[0].step in (None, 1)
+        ):
+            rows, _ = read_radolan_composite_rows(
+                content, key[0].start, key[0].stop, raw=True
+            )
+            return rows[(slice(None),) + key[1:]]
+        return self.frame(index)[key]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        index, rest = key[0], key[1:]
+        if isinstance(index, (int, np.integer)):
+            return self.frame_part(index, rest)
+        if isinstance(index, slice):
+            frames = [self.frame_part(i, rest) for i in range(*index.indices(len(self)))]
+            if not frames:
+                return np.empty((0,) + self.frame(0)[rest].shape, dtype=self.dtype)
+            return np.stack(frames)
+        # Array of frames: decode every needed frame once
+        index = np.asarray(index)
+        needed = np.unique(index)
+        frames = np.stack([self.frame(i) for i in needed])
+
+        return frames[(np.searchsorted(needed, index),) + rest]
+
+    def __array__(self, dtype=None, copy=None):
+        rr = self[:]
+        return rr if dtype is None else rr.astype(dtype)
@@ -0,0 +1,227 @@
+"""
+Store of the decoded radar runs, shared by all the workers.
+Every run is a snapshot directory keyed by the run time (UTC)
+
+    runs/<run>/cube.npy   raw uint16 cube (time, y, x), memory-mapped by readers
+    runs/<run>/meta.json  run id, time (UTC) of every frame, shape and dtype
+    runs/<run>/<name>.npy products derived from the cube (e.g. rainy)
+
+which is written under a temporary name and renamed into place once
+complete. The `latest` pointer is then atomically replaced, so readers
+always get a consistent run. The last RADAR_RETENTION runs are kept
+for comparison and replay.
+Times are kept in UTC, as the local time is ambiguous when the daylight
+saving time ends and the run ids have to be unique and increasing.
+"""
+import json
+import os
+import re
+import shutil
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from .settings import radar_dir, RADAR_RETENTION, logging
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+
+def get_snapshot_dir(run, store_dir=radar_dir):
+    """Directory of the snapshot of a run in the store"""
+    return os.path.join(store_dir, "runs", run)
+
+
+def has_snapshot(run, store_dir=radar_dir):
+    """Whether the run is (still) available in the store"""
+    return os.path.exists(os.path.join(get_snapshot_dir(run, store_dir), "meta.json"))
+
+
+def list_snapshots(store_dir=radar_dir):
+    """Ids of the runs available in the store, from the oldest to the latest"""
+    try:
+        runs = os.listdir(os.path.join(store_dir, "runs"))
+    except FileNotFoundError:
+        return []
+
+    return sorted(run for run in runs if not run.startswith("."))
+
+
+def get_latest_run(store_dir=radar_dir):
+    """Id of the latest published run, None if nothing was published yet"""
+    try:
+        with open(os.path.join(store_dir, "latest"), "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def set_latest_run(run, store_dir=radar_dir):
+    """Atomically point `latest` to run, unless a more recent run is already published"""
+    latest = get_latest_run(store_dir)
+    if latest is not None and latest > run:
+        return
+    fname = os.path.join(store_dir, "latest")
+    with open(fname + f".{os.getpid()}.tmp", "w") as f:
+        f.write(run)
+    os.replace(fname + f".{os.getpid()}.tmp", fname)
+
+
+@contextmanager
+def store_lock(store_dir=radar_dir, blocking=True):
+    """
+    Exclusive lock on the refresh of the store, shared by all the processes
+    using it. Yields whether the lock was acquired, which can only be False
+    when not blocking. The lock is released by the OS if its holder dies.
+    Without fcntl (e.g. on Windows) there is no lock across processes.
+    """
+    if not FCNTL_AVAILABLE:
+        yield True
+        return
+
+    with open(os.path.join(store_dir, "refresh.lock"), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_refresh_state(store_dir=radar_dir):
+    """
+    Read the state of the last refresh of the store, that is the latest run
+    with the validators (ETag, Last-Modified) of the file it was downloaded
+    from, and the time of the last check of the remote file.
+    Returns None if there is no (valid) state.
+    """
+    try:
+        with open(os.path.join(store_dir, "refresh.json"), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_refresh_state(state, store_dir=radar_dir):
+    """Atomically replace the state of the last refresh of the store"""
+    fname = os.path.join(store_dir, "refresh.json")
+    with open(fname + f".{os.getpid()}.tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(fname + f".{os.getpid()}.tmp", fname)
+
+
+def publish_snapshot(
+    rr, time_radar, products=None, store_dir=radar_dir, retention=RADAR_RETENTION
+):
+    """
+    Write the radar cube rr (time, y, x) of a run as raw .npy file, together
+    with a small JSON sidecar containing the metadata, so that every worker
+    can memory-map the same file instead of unpickling its own copy.
+    time_radar is the time (UTC) of every frame, the run id is the first one.
+    products is a dict name: array of products derived from the cube,
+    written alongside it.
+    The snapshot is written into a temporary directory, renamed into place
+    and only then published as the latest run. Returns the run id.
+    """
+    run = time_radar[0].strftime("%Y%m%d%H%M")
+    snapshot_dir = get_snapshot_dir(run, store_dir)
+    tmp_dir = os.path.join(store_dir, "runs", f".{run}.{os.getpid()}.tmp")
+    os.makedirs(tmp_dir)
+
+    try:
+        np.save(os.path.join(tmp_dir, "cube.npy"), rr)
+        for name, product in (products or {}).items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), product)
+        meta = {
+            "run": run,
+            "times": [t.isoformat() for t in time_radar],
+            "shape": list(rr.shape),
+            "dtype": rr.dtype.str,
+        }
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        os.rename(tmp_dir, snapshot_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        # Someone else already published the same run
+        if not has_snapshot(run, store_dir):
+            raise
+    else:
+        logging.info(f"Written radar run {run} with shape {rr.shape} to {snapshot_dir}")
+
+    set_latest_run(run, store_dir)
+    prune_snapshots(retention, store_dir)
+
+    return run
+
+
+def process_alive(pid):
+    """Whether a process with this pid is running (on this host)"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but owned by someone else
+        return True
+    return True
+
+
+def prune_snapshots(retention=RADAR_RETENTION, store_dir=radar_dir):
+    """
+    Remove all but the latest `retention` runs, together with the temporary
+    directories left by publishers which died while writing a snapshot.
+    Workers that still have the runs mapped keep their view of the data
+    until they close it.
+    """
+    latest = get_latest_run(store_dir)
+    runs = list_snapshots(store_dir)
+    for run in runs[: max(len(runs) - retention, 0)]:
+        if run != latest:
+            shutil.rmtree(get_snapshot_dir(run, store_dir), ignore_errors=True)
+
+    try:
+        names = os.listdir(os.path.join(store_dir, "runs"))
+    except FileNotFoundError:
+        return
+    for name in names:
+        match = re.fullmatch(r"\.\d+\.(\d+)\.tmp", name)
+        if match and not process_alive(int(match.group(1))):
+            logging.info(f"Removing {name} left by a failed publication")
+            shutil.rmtree(os.path.join(store_dir, "runs", name), ignore_errors=True)
+
+
+def load_snapshot(run=None, store_dir=radar_dir):
+    """
+    Memory-map (read-only) the radar cube of a run, by default the latest
+    one, from the store. Returns the time (UTC) of every frame and the cube.
+    """
+    if run is None:
+        run = get_latest_run(store_dir)
+        if run is None:
+            raise FileNotFoundError(f"No radar run published in {store_dir}")
+    snapshot_dir = get_snapshot_dir(run, store_dir)
+    with open(os.path.join(snapshot_dir, "meta.json"), "r") as f:
+        meta = json.load(f)
+    rr = np.load(os.path.join(snapshot_dir, "cube.npy"), mmap_mode="r")
+    time_radar = pd.to_datetime(meta["times"])
+
+    return time_radar, rr
+
+
+def load_product(run, name, store_dir=radar_dir):
+    """
+    Memory-map (read-only) a product derived from the radar cube of a run,
+    None if it was not published with the run.
+    """
+    try:
+        fname = os.path.join(get_snapshot_dir(run, store_dir), f"{name}.npy")
+        return np.load(fname, mmap_mode="r")
+    except FileNotFoundError:
+        return None
+
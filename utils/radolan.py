@@ -10,59 +10,75 @@ Reading RADOLAN data from German Weather Service
     :nosignatures:
     :toctree: generated/
     read_radolan_composite
+    read_radolan_composite_rows
     get_radolan_filehandle
     read_radolan_header
+    parse_header
     parse_dwd_composite_header
     read_radolan_binary_array
+    read_radolan_buffer_array
     decode_radolan_runlength_array
+    decode_radolan_16bit_array
 """
 
 # standard libraries
 # from __future__ import absolute_import
 import datetime as dt
-import io
+import mmap
 import re
 import warnings
+from functools import lru_cache
 
 # site packages
 import numpy as np
 
+# current package
+from .projection import grid_to_lonlat
+
 # current DWD file naming pattern (2008) for example:
 # raa00-dx_10488-200608050000-drs---bin
 dwdpattern = re.compile("raa..-(..)[_-]([0-9]{5})-([0-9]*)-(.*?)---bin")
 
 
-def get_radolan_header_token():
-    """Return array with known header token of radolan composites
-    Returns
-    -------
-    head : dict
-        with known header token, value set to None
-    """
-    head = {
-        "BY": None,
-        "VS": None,
-        "SW": None,
-        "PR": None,
-        "INT": None,
-        "GP": None,
-        "MS": None,
-        "LV": None,
-        "CS": None,
-        "MX": None,
-        "BG": None,
-        "ST": None,
-        "VV": None,
-        "MF": None,
-        "QN": None,
-        "VR": None,
-        "U": None,
-    }
-    return head
-
-
-def get_radolan_header_token_pos(header):
-    """Get Token and positions from DWD radolan header
+# known header token of radolan composites, in the order they are evaluated
+radolan_header_token = (
+    "BY",
+    "VS",
+    "SW",
+    "PR",
+    "INT",
+    "GP",
+    "MS",
+    "LV",
+    "CS",
+    "MX",
+    "BG",
+    "ST",
+    "VV",
+    "MF",
+    "QN",
+    "VR",
+    "U",
+)
+
+# every token is directly followed by its value, which runs up to the next
+# token (values can contain upper case letters, e.g. "SW P300001"). Lists
+# of radar sites are enclosed in <> and may contain anything.
+tokenpattern = re.compile(
+    "({0})((?:<[^>]*>|(?!{0})[^<])*)".format("|".join(radolan_header_token))
+)
+
+# size of the blocks read while looking for the end of the header
+HEADER_BLOCKSIZE = 1024
+
+# raw (integer) data is always expressed in units of RAW_PRECISION, whatever
+# the precision of the single file, and RAW_NODATA flags no-data cells
+RAW_PRECISION = 0.01
+RAW_NODATA = np.iinfo(np.uint16).max
+
+
+def get_radolan_header_token_values(header):
+    """Get Token and values from DWD radolan header in a single pass
     Parameters
     ----------
     header : string
@@ -70,32 +86,12 @@ def get_radolan_header_token_pos(header):
     Returns
     -------
     head : dictionary
-        with found header tokens and positions
+        with found header tokens and their (raw) values
     """
+    # the first 17 characters are fixed width fields (product, time, id)
+    found = dict(tokenpattern.findall(header, 17))
 
-    head_dict = get_radolan_header_token()
-
-    for token in head_dict.keys():
-        d = header.rfind(token)
-        if d > -1:
-            head_dict[token] = d
-    head = {}
-
-    result_dict = {}
-    result_dict.update((k, v) for k, v in head_dict.items() if v is not None)
-    for k, v in head_dict.items():
-        if v is not None:
-            start = v + len(k)
-            filt = [x for x in result_dict.values() if x > v]
-            if filt:
-                stop = min(filt)
-            else:
-                stop = len(header)
-            head[k] = (start, stop)
-        else:
-            head[k] = v
-
-    return head
+    return {k: found[k] for k in radolan_header_token if k in found}
 
 
 def parse_dwd_composite_header(header):
@@ -121,37 +117,36 @@ def parse_dwd_composite_header(header):
     # radar location ID (always 10000 for composites)
     out["radarid"] = header[8:13]
 
-    # get dict of header token with positions
-    head = get_radolan_header_token_pos(header)
+    # get dict of header token with values
+    head = get_radolan_header_token_values(header)
     # iterate over token and fill output dict accordingly
-    # for k, v in head.iteritems():
     for k, v in head.items():
         if v:
             if k == "BY":
-                out["datasize"] = int(header[v[0] : v[1]]) - len(header) - 1
+                out["datasize"] = int(v) - len(header) - 1
             if k == "VS":
                 out["maxrange"] = {
                     0: "100 km and 128 km (mixed)",
                     1: "100 km",
                     2: "128 km",
                     3: "150 km",
-                }.get(int(header[v[0] : v[1]]), "100 km")
+                }.get(int(v), "100 km")
             if k == "SW":
-                out["radolanversion"] = header[v[0] : v[1]].strip()
+                out["radolanversion"] = v.strip()
             if k == "PR":
-                out["precision"] = float("1" + header[v[0] : v[1]].strip())
+                out["precision"] = float("1" + v.strip())
             if k == "INT":
-                out["intervalseconds"] = int(header[v[0] : v[1]]) * 60
+                out["intervalseconds"] = int(v) * 60
             if k == "U":
-                out["intervalunit"] = int(header[v[0] : v[1]])
+                out["intervalunit"] = int(v)
                 if out["intervalunit"] == 1:
                     out["intervalseconds"] *= 1440
             if k == "GP":
-                dimstrings = header[v[0] : v[1]].strip().split("x")
+                dimstrings = v.strip().split("x")
                 out["nrow"] = int(dimstrings[0])
                 out["ncol"] = int(dimstrings[1])
             if k == "BG":
-                dimstrings = header[v[0] : v[1]]
+                dimstrings = v
                 dimstrings = (
                     dimstrings[: int(len(dimstrings) / 2)],
                     dimstrings[int(len(dimstrings) / 2) :],
@@ -159,116 +154,40 @@ def parse_dwd_composite_header(header):
                 out["nrow"] = int(dimstrings[0])
                 out["ncol"] = int(dimstrings[1])
             if k == "LV":
-                lv = header[v[0] : v[1]].split()
-                out["nlevel"] = np.int(lv[0])
+                lv = v.split()
+                out["nlevel"] = int(lv[0])
                 out["level"] = np.array(lv[1:]).astype("float")
             if k == "MS":
-                locationstring = header[v[0] :].strip().split("<")[1].split(">")[0]
+                locationstring = v.strip().split("<")[1].split(">")[0]
                 out["radarlocations"] = locationstring.split(",")
             if k == "ST":
-                locationstring = header[v[0] :].strip().split("<")[1].split(">")[0]
+                locationstring = v.strip().split("<")[1].split(">")[0]
                 out["radardays"] = locationstring.split(",")
             if k == "CS":
                 out["indicator"] = {
                     0: "near ground level",
                     1: "maximum",
                     2: "tops",
-                }.get(int(header[v[0] : v[1]]))
+                }.get(int(v))
             if k == "MX":
-                out["imagecount"] = int(header[v[0] : v[1]])
+                out["imagecount"] = int(v)
             if k == "VV":
-                out["predictiontime"] = int(header[v[0] : v[1]])
+                out["predictiontime"] = int(v)
             if k == "MF":
-                out["moduleflag"] = int(header[v[0] : v[1]])
+                out["moduleflag"] = int(v)
             if k == "QN":
-                out["quantification"] = int(header[v[0] : v[1]])
+                out["quantification"] = int(v)
             if k == "VR":
-                out["reanalysisversion"] = header[v[0] : v[1]].strip()
+                out["reanalysisversion"] = v.strip()
     return out
 
 
-def decode_radolan_runlength_line(line, attrs):
-    """Decodes one line of runlength coded binary data of DWD
-    composite file and returns decoded array
-    Parameters
-    ----------
-    line : :func:`numpy:numpy.array`
-        of byte values
-    attrs : dict
-        dictionary of attributes derived from file header
-    Returns
-    -------
-    arr : :func:`numpy:numpy.array`
-        of decoded values
-    """
-    # byte '0' is line number, we don't need it
-    # so we start with offset byte,
-    lo = 1
-    byte = line[lo]
-    # line empty condition, lf directly behind line number
-    if byte == 10:
-        return np.ones(attrs["ncol"], dtype=np.uint8) * attrs["nodataflag"]
-    offset = byte - 16
-
-    # check if offset byte is 255 and take next byte(s)
-    # also for the offset
-    while byte == 255:
-        lo += 1
-        byte = line[lo]
-        offset += byte - 16
-
-    # just take the rest
-    dline = line[lo + 1 :]
-
-    # this could be optimized
-    # iterate over line string, until lf (10) is reached
-    for lo, byte in enumerate(dline):
-        if byte == 10:
-            break
-        width = (byte & 0xF0) >> 4
-        val = byte & 0x0F
-        # the "offset pixel" are "not measured" values
-        # so we set them to 'nodata'
-        if lo == 0:
-            arr = np.ones(offset, dtype=np.uint8) * attrs["nodataflag"]
-        arr = np.append(arr, np.ones(width, dtype=np.uint8) * val)
-
-    trailing = attrs["ncol"] - len(arr)
-    if trailing > 0:
-        arr = np.append(arr, np.ones(trailing, dtype=np.uint8) * attrs["nodataflag"])
-    elif trailing < 0:
-        arr = dline[:trailing]
-
-    return arr
-
-
-def read_radolan_runlength_line(fid):
-    """Reads one line of runlength coded binary data of DWD
-    composite file and returns it as numpy array
-    Parameters
-    ----------
-    fid : object
-        file/buffer id
-    Returns
-    -------
-    line : :func:`numpy:numpy.array`
-        of coded values
-    """
-    line = fid.readline()
-
-    # check if eot
-    if line == b"\x04":
-        return None
-
-    # convert input buffer to np.uint8 array
-    line = np.frombuffer(line, np.uint8).astype(np.uint8)
-
-    return line
-
-
 def decode_radolan_runlength_array(binarr, attrs):
     """Decodes the binary runlength coded section from DWD composite
     file and return decoded numpy array with correct shape
+    The buffer is split into lines in one pass and the (width, value)
+    nibbles of all lines are expanded at once with :func:`numpy:numpy.repeat`
+    into a preallocated array, so that decoding is linear in the buffer size.
     Parameters
     ----------
     binarr : string
@@ -280,21 +199,65 @@ def decode_radolan_runlength_array(binarr, attrs):
     arr : :func:`numpy:numpy.array`
         of decoded values
     """
-    buf = io.BytesIO(binarr)
-
-    # read and decode first line
-    line = read_radolan_runlength_line(buf)
-    arr = decode_radolan_runlength_line(line, attrs)
+    nrow, ncol = attrs["nrow"], attrs["ncol"]
+    nodata = attrs["nodataflag"]
+    arr = np.full(
+        (nrow, ncol),
+        nodata,
+        dtype=np.promote_types(np.uint8, np.min_scalar_type(nodata)),
+    )
 
-    # read following lines
-    line = read_radolan_runlength_line(buf)
+    buf = np.frombuffer(binarr, np.uint8)
+    # every line is terminated by lf (10), the trailing eot (4) is
+    # not terminated and thus never considered as a line
+    ends = np.flatnonzero(buf == 10)
+    if ends.size == 0:
+        return arr
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    nlines = ends.size
+
+    # byte '0' is line number, we don't need it so we start with offset byte,
+    # line empty condition is lf directly behind line number
+    empty = ends - starts < 2
+    lo = np.minimum(starts + 1, ends)
+    offset = buf[lo].astype(np.intp) - 16
+    # if the offset byte is 255 take next byte(s) also for the offset
+    cont = (buf[lo] == 255) & ~empty
+    while cont.any():
+        lo[cont] += 1
+        offset[cont] += buf[lo[cont]].astype(np.intp) - 16
+        cont[cont] = buf[lo[cont]] == 255
+
+    # gather the data bytes of all lines, i.e. everything between
+    # the offset byte(s) and the lf
+    nbytes = np.where(empty, 0, ends - lo - 1)
+    byte_line = np.repeat(np.arange(nlines), nbytes)
+    byte_start = np.cumsum(nbytes) - nbytes
+    byte_pos = (
+        np.arange(byte_line.size)
+        - np.repeat(byte_start, nbytes)
+        + np.repeat(lo + 1, nbytes)
+    )
+    data = buf[byte_pos]
+    width = (data & 0xF0) >> 4
+    value = data & 0x0F
+
+    # expand the runs, the "offset pixel" are "not measured" values
+    # and stay 'nodata' as the trailing pixels do
+    npix = np.bincount(byte_line, weights=width, minlength=nlines).astype(np.intp)
+    pix_line = np.repeat(byte_line, width)
+    pix_value = np.repeat(value, width)
+    pix_col = (
+        np.arange(pix_line.size)
+        - np.repeat(np.cumsum(npix) - npix, npix)
+        + np.repeat(offset, npix)
+    )
+    # first line read is top line, so fill the array upside down
+    pix_row = nrow - 1 - pix_line
+    valid = (pix_col >= 0) & (pix_col < ncol) & (pix_row >= 0)
+    arr[pix_row[valid], pix_col[valid]] = pix_value[valid]
 
-    while line is not None:
-        dline = decode_radolan_runlength_line(line, attrs)
-        arr = np.vstack((arr, dline))
-        line = read_radolan_runlength_line(buf)
-    # return upside down because first line read is top line
-    return np.flipud(arr)
+    return arr
 
 
 def read_radolan_binary_array(fid, size):
@@ -320,6 +283,30 @@ def read_radolan_binary_array(fid, size):
     return binarr
 
 
+def read_radolan_buffer_array(buffer, offset, size):
+    """Read binary data from a buffer holding the whole file
+    Parameters
+    ----------
+    buffer : bytes-like
+        content of the file
+    offset : int
+        position of the first data byte
+    size : int
+        number of bytes to read
+    Returns
+    -------
+    binarr : memoryview
+        array of binary data, no copy is made
+    """
+    binarr = memoryview(buffer).cast("B")[offset : offset + size]
+    if len(binarr) != size:
+        raise IOError(
+            "{0}: Buffer corruption while reading! \nCould not "
+            "read enough data!".format(__name__)
+        )
+    return binarr
+
+
 def get_radolan_filehandle(fname):
     """Opens radolan file and returns file handle
     Parameters
@@ -343,6 +330,9 @@ def get_radolan_filehandle(fname):
 
 def read_radolan_header(fid):
     """Reads radolan ASCII header and returns it as string
+    The file is read in blocks of HEADER_BLOCKSIZE bytes until the end of
+    the header (ETX) is found, afterwards the file is positioned at the
+    first data byte.
     Parameters
     ----------
     fid : object
@@ -354,18 +344,47 @@ def read_radolan_header(fid):
     # rewind, just in case...
     fid.seek(0, 0)
 
-    header = ""
+    header = b""
     while True:
-        mychar = fid.read(1)
-        if not mychar:
+        block = fid.read(HEADER_BLOCKSIZE)
+        if not block:
             raise EOFError("Unexpected EOF detected while reading " "RADOLAN header")
-        if mychar == b"\x03":
+        etx = block.find(b"\x03")
+        if etx > -1:
+            header += block[:etx]
             break
-        header += str(mychar.decode())
-    return header
+        header += block
+    # position the file right behind the header
+    fid.seek(len(header) + 1, 0)
+
+    return header.decode()
+
+
+def parse_header(buffer):
+    """Parses the header of a RADOLAN composite held in memory
+    Parameters
+    ----------
+    buffer : bytes-like
+        content (or at least the beginning) of the composite file
+    Returns
+    -------
+    output : tuple
+        tuple of two items (attrs, offset):
+            - attrs : dictionary of metadata information from the header
+            - offset : position of the first data byte in buffer
+    """
+    buffer = memoryview(buffer).cast("B")
+    etx = bytes(buffer[:HEADER_BLOCKSIZE]).find(b"\x03")
+    if etx == -1:
+        etx = bytes(buffer).find(b"\x03")
+    if etx == -1:
+        raise EOFError("Unexpected EOF detected while reading " "RADOLAN header")
+    attrs = parse_dwd_composite_header(bytes(buffer[:etx]).decode())
 
+    return attrs, etx + 1
 
-def read_radolan_composite(f, missing=-9999, loaddata=True):
+
+def read_radolan_composite(f, missing=-9999, loaddata=True, raw=False):
     """Read quantitative radar composite format of the German Weather Service
     The quantitative composite format of the DWD (German Weather Service) was
     established in the course of the
@@ -385,12 +404,16 @@ def read_radolan_composite(f, missing=-9999, loaddata=True):
     keyword "precision".
     Parameters
     ----------
-    f : string or file handle
-        path to the composite file or file handle
+    f : string, file handle or bytes-like
+        path to the composite file, file handle or content of the file
     missing : int
         value assigned to no-data cells
     loaddata : bool
         True | False, If False function returns (None, attrs)
+    raw : bool
+        True | False, If True data is returned as compact uint16 counts in
+        units of RAW_PRECISION with no-data cells set to RAW_NODATA, instead
+        of applying the precision factor (see :func:`raw_to_rain_rate`)
     Returns
     -------
     output : tuple
@@ -404,19 +427,23 @@ def read_radolan_composite(f, missing=-9999, loaddata=True):
     """
 
     NODATA = missing
-    mask = 0xFFF  # max value integer
 
-    # If a file name is supplied, get a file handle
-    try:
-        header = read_radolan_header(f)
-    except AttributeError:
-        f = get_radolan_filehandle(f)
-        header = read_radolan_header(f)
+    # If the content of the file is supplied, parse it directly
+    if isinstance(f, (bytes, bytearray, memoryview, mmap.mmap)):
+        attrs, offset = parse_header(f)
+    else:
+        # If a file name is supplied, get a file handle
+        try:
+            header = read_radolan_header(f)
+        except AttributeError:
+            f = get_radolan_filehandle(f)
+            header = read_radolan_header(f)
 
-    attrs = parse_dwd_composite_header(header)
+        attrs = parse_dwd_composite_header(header)
 
     if not loaddata:
-        f.close()
+        if not isinstance(f, (bytes, bytearray, memoryview, mmap.mmap)):
+            f.close()
         return None, attrs
 
     attrs["nodataflag"] = NODATA
@@ -431,39 +458,140 @@ def read_radolan_composite(f, missing=-9999, loaddata=True):
         )
 
     # read the actual data
-    indat = read_radolan_binary_array(f, attrs["datasize"])
+    if isinstance(f, (bytes, bytearray, memoryview, mmap.mmap)):
+        indat = read_radolan_buffer_array(f, offset, attrs["datasize"])
+    else:
+        indat = read_radolan_binary_array(f, attrs["datasize"])
 
     if attrs["producttype"] in ["RX", "EX", "WX"]:
         # convert to 8bit integer
         arr = np.frombuffer(indat, np.uint8).astype(np.uint8)
-        arr = np.where(arr == 250, NODATA, arr)
         attrs["cluttermask"] = np.where(arr == 249)[0]
+        if raw:
+            nodata = arr == 250
+            arr = arr.astype(np.uint16) * np.uint16(round(1 / RAW_PRECISION))
+            arr[nodata] = RAW_NODATA
+        else:
+            arr = np.where(arr == 250, NODATA, arr)
     elif attrs["producttype"] in ["PG", "PC"]:
         arr = decode_radolan_runlength_array(indat, attrs)
+        if raw:
+            arr = np.where(arr == NODATA, RAW_NODATA, arr).astype(np.uint16)
+    else:
+        arr = decode_radolan_16bit_array(indat, attrs, NODATA, raw)
+
+    # anyway, bring it into right shape
+    arr = arr.reshape((attrs["nrow"], attrs["ncol"]))
+
+    return arr, attrs
+
+
+def decode_radolan_16bit_array(binarr, attrs, missing=-9999, raw=False):
+    """Decodes the binary data of 16-bit RADOLAN composites (e.g. RY, WN)
+    Parameters
+    ----------
+    binarr : bytes-like
+        binary data (little-endian 16-bit words), the whole grid or any
+        number of rows
+    attrs : dict
+        dictionary of attributes derived from file header
+    missing : int
+        value assigned to no-data cells
+    raw : bool
+        see :func:`read_radolan_composite`
+    Returns
+    -------
+    arr : :func:`numpy:numpy.array`
+        flat array of decoded values
+    """
+    mask = 0xFFF  # max value integer
+    # convert to 16-bit integers
+    arr = np.frombuffer(binarr, np.uint16).astype(np.uint16)
+    # evaluate bits 13, 14, 15 and 16
+    attrs["secondary"] = np.where(arr & 0x1000)[0]
+    nodata = np.where(arr & 0x2000)[0]
+    negative = np.where(arr & 0x4000)[0]
+    attrs["cluttermask"] = np.where(arr & 0x8000)[0]
+    # mask out the last 4 bits
+    arr &= mask
+    # consider negative flag if product is RD (differences from adjustment)
+    if attrs["producttype"] == "RD":
+        # NOT TESTED, YET
+        arr[negative] = -arr[negative]
+    if raw:
+        # keep the integer counts but bring them to RAW_PRECISION
+        scale = attrs["precision"] / RAW_PRECISION
+        if scale != 1:
+            arr = np.rint(np.minimum(arr * scale, RAW_NODATA - 1))
+            arr = arr.astype(np.uint16)
+        arr[nodata] = RAW_NODATA
     else:
-        # convert to 16-bit integers
-        arr = np.frombuffer(indat, np.uint16).astype(np.uint16)
-        # evaluate bits 13, 14, 15 and 16
-        attrs["secondary"] = np.where(arr & 0x1000)[0]
-        nodata = np.where(arr & 0x2000)[0]
-        negative = np.where(arr & 0x4000)[0]
-        attrs["cluttermask"] = np.where(arr & 0x8000)[0]
-        # mask out the last 4 bits
-        arr &= mask
-        # consider negative flag if product is RD (differences from adjustment)
-        if attrs["producttype"] == "RD":
-            # NOT TESTED, YET
-            arr[negative] = -arr[negative]
         # apply precision factor
         # this promotes arr to float if precision is float
         arr = arr * attrs["precision"]
         # set nodata value
-        arr[nodata] = NODATA
+        arr[nodata] = missing
 
-    # anyway, bring it into right shape
-    arr = arr.reshape((attrs["nrow"], attrs["ncol"]))
+    return arr
 
-    return arr, attrs
+
+def read_radolan_composite_rows(f, row_start, row_stop, missing=-9999, raw=False):
+    """Read only the rows row_start:row_stop of an uncompressed 16-bit
+    RADOLAN composite (e.g. WN). As every row has a fixed size, the byte
+    range of the rows is computed from the header and only these bytes are
+    read (file) or touched (bytes-like, e.g. mmap), the rest of the grid is
+    never decoded.
+    Parameters
+    ----------
+    f : string, file handle or bytes-like
+        path to the composite file, file handle, content of the file or
+        mmap of the file
+    row_start, row_stop : int
+        range of rows to read, as in a slice (0 is the southern border)
+    missing : int
+        value assigned to no-data cells
+    raw : bool
+        see :func:`read_radolan_composite`
+    Returns
+    -------
+    output : tuple
+        tuple of two items (data, attrs):
+            - data : :func:`numpy:numpy.array` of shape (row_stop - row_start,
+              number of columns)
+            - attrs : dictionary of metadata information from the file header
+    """
+    if isinstance(f, (bytes, bytearray, memoryview, mmap.mmap)):
+        attrs, offset = parse_header(f)
+    else:
+        try:
+            header = read_radolan_header(f)
+        except AttributeError:
+            f = get_radolan_filehandle(f)
+            header = read_radolan_header(f)
+        attrs = parse_dwd_composite_header(header)
+        offset = len(header) + 1
+
+    if attrs["producttype"] in ["RX", "EX", "WX", "PG", "PC"]:
+        raise ValueError(
+            "{0}: row range reads need a 16-bit product, not {1}".format(
+                __name__, attrs["producttype"]
+            )
+        )
+    row_start, row_stop, _ = slice(row_start, row_stop).indices(attrs["nrow"])
+    row_stop = max(row_start, row_stop)
+    rowsize = attrs["ncol"] * 2
+    offset += row_start * rowsize
+    size = (row_stop - row_start) * rowsize
+
+    attrs["nodataflag"] = missing
+    if isinstance(f, (bytes, bytearray, memoryview, mmap.mmap)):
+        indat = read_radolan_buffer_array(f, offset, size)
+    else:
+        f.seek(offset, 0)
+        indat = read_radolan_binary_array(f, size)
+    arr = decode_radolan_16bit_array(indat, attrs, missing, raw)
+
+    return arr.reshape((row_stop - row_start, attrs["ncol"])), attrs
 
 
 def idecibel(x):
@@ -518,14 +646,60 @@ def to_rain_rate(z):
     return rain
 
 
-def get_latlon_radar(file="radolan_grid.pickle"):
-    import pickle
+def get_rain_rate_lut():
+    """Lookup table from every possible raw count to rain rate in mm/h,
+    no-data cells are treated as no precipitation."""
+    lut = to_rain_rate(np.arange(RAW_NODATA + 1) * RAW_PRECISION)
+    lut[RAW_NODATA] = 0
+    lut.setflags(write=False)
+
+    return lut
+
+
+# Built once at import, so that any conversion is a single lookup
+RAIN_RATE_LUT = get_rain_rate_lut()
+
+
+def raw_to_rain_rate(raw):
+    """Conversion between raw counts (see :func:`read_radolan_composite`)
+    and mm/h through RAIN_RATE_LUT. Also works on whole frames. Float input
+    is accepted as well so that NaN can be used to mark missing values."""
+    raw = np.asarray(raw)
+    if raw.dtype.kind in "ui":
+        return np.take(RAIN_RATE_LUT, raw)
+
+    rain = np.full(raw.shape, np.nan)
+    valid = ~np.isnan(raw)
+    rain[valid] = np.take(RAIN_RATE_LUT, raw[valid].astype(np.intp))
+
+    return rain
+
+
+def raw_to_rainy_count(raw):
+    """Cumulative count over time (first axis) of the frames with rain
+    (rain rate > 0) of the raw counts, with a leading frame of zeros, so
+    that the number of frames i..j-1 with rain of any cell is
+    ``count[j] - count[i]``. The count is exact and in the smallest unsigned
+    integer type that fits the number of frames (uint8 for a WN run).
+    Computed frame by frame to keep the memory low."""
+    count = np.zeros(
+        (raw.shape[0] + 1,) + raw.shape[1:], dtype=np.min_scalar_type(raw.shape[0])
+    )
+    for i in range(raw.shape[0]):
+        count[i + 1] = count[i] + (raw_to_rain_rate(raw[i]) > 0)
+
+    return count
+
 
-    """Get the lat/lon coordinates of RADOLAN from a file
-    so that we don't need to recreate them every time.
-    We need to evaluate whether pickle is the fastest choice.
+@lru_cache(maxsize=None)
+def get_latlon_radar(nrow=900, ncol=900):
+    """Get the lat/lon coordinates of the RADOLAN grid nodes. These are
+    computed analytically from the projection (see :mod:`utils.projection`)
+    the first time and then kept in memory, read-only.
     Returns, in order, lon and lat 2-d arrays."""
-    with open(file, "rb") as handle:
-        radolan_grid_ll = pickle.load(handle)
+    row, col = np.mgrid[0:nrow, 0:ncol]
+    lon_radar, lat_radar = grid_to_lonlat(row, col, nrow, ncol)
+    lon_radar.setflags(write=False)
+    lat_radar.setflags(write=False)
 
-    return (radolan_grid_ll[:, :, 0], radolan_grid_ll[:, :, 1])
+    return lon_radar, lat_radar
@@ -13,9 +13,44 @@ logging.basicConfig(
 URL_BASE_PATHNAME = "/nmwr/"
 CACHE_DIR = '/var/cache/nmwr/'
 RADAR_URL = 'https://opendata.dwd.de/weather/radar/composite/wn'
+# A new radar run is published every RADAR_RUN_INTERVAL seconds: once it is
+# expected, check for it at most every RADAR_CHECK_INTERVAL seconds
+RADAR_RUN_INTERVAL = 300
+RADAR_CHECK_INTERVAL = 30
+# Who refreshes the radar data: "inline" downloads it within the web requests
+# when needed, "daemon" only loads what the ingest (python -m utils.ingest) published
+RADAR_INGEST = os.getenv("RADAR_INGEST", "inline")
+# Number of past radar runs kept in the radar store
+RADAR_RETENTION = int(os.getenv("RADAR_RETENTION", 6))
 APIURL_PLACES = 'https://api.mapbox.com/geocoding/v5/mapbox.places'
 APIURL_DIRECTIONS = 'https://api.mapbox.com/directions/v5/mapbox'
 apiKey = os.getenv("MAPBOX_KEY", "")
+# The radar tarball is downloaded in chunks of RADAR_CHUNK_SIZE bytes, up to
+# RADAR_PREFETCH_CHUNKS ahead of the decoding, and decompressed in steps of
+# at most RADAR_BUFFER_SIZE bytes, so that the memory used stays bounded
+RADAR_CHUNK_SIZE = 1024 * 1024
+RADAR_PREFETCH_CHUNKS = 8
+RADAR_BUFFER_SIZE = 4 * 1024 * 1024
+# (connect, read) timeouts in seconds of the requests to the radar server,
+# which are made while holding the refresh lock
+RADAR_TIMEOUT = (10, 60)
+# Number of processes used to decode the radar frames of a run,
+# with 0 or 1 the frames are decoded serially in the calling process.
+# A WN frame decodes in about 10 ms, so starting the pool and sending the
+# files to it costs as much as decoding a run (see benchmarks/bench_decode.py):
+# it only pays off with several idle cores and slow (e.g. compressed) frames
+RADAR_DECODE_WORKERS = int(os.getenv("RADAR_DECODE_WORKERS", 0))
+# Number of frames of a WN run (now and every 5 minutes up to 2 hours),
+# for which the cube is preallocated when decoding in parallel
+RADAR_FRAMES = 25
+# What a worker does with the shared cache when it starts: "warm" keeps the
+# entries (they are keyed by radar run and expire on their own) and preloads
+# the latest radar run, "clear" wipes the cache
+CACHE_STARTUP = os.getenv("CACHE_STARTUP", "warm")
+# Number of threads used to get the directions of the routes of a batch request
+ROUTING_WORKERS = int(os.getenv("ROUTING_WORKERS", 8))
+# Size (MB) of the in-process cache in front of the filesystem cache, per worker
+MEMORY_CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", 256)) * 1024**2
 
 # Here set the shifts (in units of 5 minutes per shift) for the final forecast
 shifts = (1, 2, 3, 5, 7, 10, 13)
@@ -73,8 +108,13 @@ def get_cache_directory():
 cache_dir = get_cache_directory()
 
 if cache_dir:
+    # Keep the radar data and the flask_caching entries in separate
+    # directories, as the latter assumes it owns every file in its directory
+    radar_dir = os.path.join(cache_dir, "radar")
+    os.makedirs(radar_dir, exist_ok=True)
     cache = Cache(config={"CACHE_TYPE": "filesystem",
-                          "CACHE_DIR": cache_dir,
-                          "CACHE_THRESHOLD": 20})
+                          "CACHE_DIR": os.path.join(cache_dir, "flask"),
+                          "CACHE_THRESHOLD": 1000})
 else:
+    radar_dir = None
     cache = Cache(config={"CACHE_TYPE": "null"})
@@ -1,27 +1,26 @@
+import functools
+import hashlib
+import time
 import pandas as pd
-from datetime import timedelta
-import re
 import requests
-import os
-import glob
 import numpy as np
 import json
-import bz2
 import plotly.graph_objs as go
 import plotly.express as px
-from sklearn.neighbors import BallTree
 from .settings import (
     shifts,
     apiKey,
-    cache,
-    CACHE_DIR,
-    RADAR_URL,
     APIURL_PLACES,
     APIURL_DIRECTIONS,
+    radar_dir,
+    RADAR_INGEST,
     logging,
 )
-from .radolan import read_radolan_composite, get_latlon_radar, to_rain_rate
-import tarfile
+from .radolan import get_latlon_radar, raw_to_rain_rate, raw_to_rainy_count
+from .radar_store import load_snapshot, load_product, get_latest_run
+from .ingest import refresh_radar_cube, refresh_radar_run, convert_timezone
+from .projection import nearest_cell, grid_bbox, on_grid
+from .memory_cache import memoize
 
 try:
     import simplification.cutil as simpl
@@ -30,16 +29,29 @@ except ImportError:
     SIMPLIFICATION_AVAILABLE = False
 
 
-@cache.memoize(900)
+def get_place_center(point):
+    """
+    Name and [lon, lat] of an address, or of a point given
+    directly as [lon, lat] coordinates (then named by them)
+    """
+    if isinstance(point, (list, tuple)):
+        lon, lat = float(point[0]), float(point[1])
+        return f"{lat:.5f}, {lon:.5f}", [lon, lat]
+
+    return get_place_address(point, limit=1)
+
+
+@memoize(900)
 def get_directions(
     start_point, end_point, mode="cycling", simplify=True, simplify_tolerance=0.0001
 ):
     """
     Get directions using mapbox API. Note that this is cached
     so that we already use directions if we already have them.
+    Start and end can be addresses or [lon, lat] coordinates.
     """
-    sourcePlace, sourceCenter = get_place_address(start_point, limit=1)
-    destPlace, destCenter = get_place_address(end_point, limit=1)
+    sourcePlace, sourceCenter = get_place_center(start_point)
+    destPlace, destCenter = get_place_center(end_point)
     sourceLon, sourceLat = sourceCenter
     destLon, destLat = destCenter
 
@@ -91,7 +103,7 @@ def get_directions(
     return sourcePlace, destPlace, lons, lats, dtime, meta
 
 
-@cache.memoize(900)
+@memoize(900)
 def get_place_address(place, 
                       country=None, # 'de,fr,ch,at'
                       limit=5,
@@ -126,7 +138,7 @@ def get_place_address(place,
     return place_name, place_center
 
 
-@cache.memoize(900)
+@memoize(900)
 def get_place_address_reverse(lon, lat,
                               country=None,
                               limit=1,
@@ -167,14 +179,35 @@ def distance_km(lon1, lon2, lat1, lat2):
     return d
 
 
-def convert_timezone(dt_from, from_tz="utc", to_tz="Europe/Berlin"):
+def route_from_geometry(
+    coordinates, durations=None, speed=15.0, grid_shape=(900, 900)
+):
     """
-    Convert between two timezones. dt_from needs to be a Timestamp
-    object, don't know if it works otherwise.
+    Track of a route given directly as a list of [lon, lat] coordinates.
+    durations are the seconds elapsed at every point from the start; if
+    not given they are estimated from the distance at speed (km/h).
+    Raises ValueError if a coordinate or duration is not finite or a point
+    is outside of the radar grid of shape grid_shape.
+    Returns lons, lats and the timedelta of every point, like get_directions.
     """
-    dt_to = dt_from.tz_localize(from_tz).tz_convert(to_tz)
-    # remove again the timezone information
-    return dt_to.tz_localize(None)
+    steps = np.asarray(coordinates, dtype=float)
+    if steps.ndim != 2 or steps.shape[0] < 2 or steps.shape[1] < 2:
+        raise ValueError("A route geometry needs at least two [lon, lat] points")
+    lons, lats = steps[:, 0], steps[:, 1]
+    if not (np.isfinite(lons).all() and np.isfinite(lats).all()):
+        raise ValueError("Invalid coordinates in the route geometry")
+    if not on_grid(lons, lats, *grid_shape).all():
+        raise ValueError("The route geometry is outside of the radar coverage")
+    if durations is None:
+        distance = distance_km(lons[:-1], lons[1:], lats[:-1], lats[1:])
+        durations = np.insert(np.cumsum(distance / speed * 3600.0), 0, 0)
+    elif len(durations) != len(lons):
+        raise ValueError("A route geometry needs one duration for every point")
+    elif not np.isfinite(np.asarray(durations, dtype=float)).all():
+        raise ValueError("Invalid durations in the route geometry")
+    dtime = pd.Series(pd.to_timedelta(np.asarray(durations, dtype=float), unit="s"))
+
+    return lons, lats, dtime
 
 
 def strfdelta(tdelta, fmt):
@@ -184,158 +217,338 @@ def strfdelta(tdelta, fmt):
     return fmt.format(**d)
 
 
-@cache.memoize(240)
-def get_radar_data(
-    data_path=CACHE_DIR,
-    base_radar_url=RADAR_URL,
-):
+def get_radar_run():
+    """
+    Id of the radar run currently served, None without a radar store.
+    With RADAR_INGEST=daemon the run is only looked up in the store and
+    never downloaded while serving a request.
+    """
+    if radar_dir is None:
+        return None
+    if RADAR_INGEST == "daemon":
+        return get_latest_run()
+    return refresh_radar_run()
+
+
+@functools.lru_cache(maxsize=2)
+def load_radar_run(run):
+    """Memory-map a run of the radar store once per process"""
+    return load_snapshot(run)
+
+
+def get_radar_data(run=None):
     """
-    Only update radar data every 5 minutes, although this is not
-    really 100% correct as we should check the remote version
-    TODO We should read the timestamp from the file and compare it with
-    the server
-    """
-    # Remove older files
-    # This should be fine as we're only going into this function if there is new data
-    # to download, so we don't want to keep a copy of the old data
-    for f in glob.glob(f"{data_path}/WN??????????_???"):
-        os.remove(f)
-    # Download and extract bz2
-    filename = data_path + "WN_LATEST.tar"
-    r = requests.get(f"{base_radar_url}/WN_LATEST.tar.bz2", stream=True)
-    if r.status_code == requests.codes.ok:
-        with r.raw as source, open(filename, "wb") as dest:
-            dest.write(bz2.decompress(source.read()))
+    Get the radar data of a run (by default the one currently served),
+    memory-mapped from the radar store when this is available.
+    """
+    if radar_dir is None:
+        # Without radar store the run is kept in memory and only the
+        # frames that are used get decoded
+        time_radar, rr = refresh_radar_cube()
     else:
-        r.raise_for_status()
-    # Extract tar
-    tar_file = tarfile.open(filename)
-    extracted_files = tar_file.getnames()
-    tar_file.extractall(data_path)
-    extracted_files = [f"{data_path}{s}" for s in extracted_files]
-    # Remove tar file
-    os.remove(filename)
-
-    return process_radar_data(extracted_files)
-
-
-def process_radar_data(fnames):
-    """
-    Take the list of files fnames and extract the data using
-    the radolan module, which was extracted from wradlib.
-    It also concatenates the files in time and returns
-    a numpy array.
-    """
-    data = []
-    time_radar = []
-    # I tried to parallelize this but it actually becomes slower
-    for fname in fnames:
-        rxdata, rxattrs = read_radolan_composite(fname)
-        data.append(rxdata)
-        minute = int(re.findall(r"(?:_)(\d{3})", fname)[0])
-        time_radar.append((rxattrs["datetime"] + timedelta(minutes=minute)))
-
-    # Conversion to numpy array
-    # !!! The conversion to mm/h is done afterwards to avoid memory usage !!!
-    data = np.array(data)
-
-    # Get rid of masking value, we have to check whether this cause problem
-    # In this case missing data is treated as 0 (no precip.). Masked arrays
-    # cause too many problems.
-    data[data == -9999] = 0.0
-    rr = data
-
-    # Get coordinates (space/time)
-    lon_radar, lat_radar = get_latlon_radar()
-    time_radar = convert_timezone(pd.to_datetime(time_radar))
+        time_radar, rr = load_radar_run(run or get_radar_run())
+
+    # Get coordinates (space/time), the time steps are computed in UTC
+    # so that they are right also when the daylight saving time changes
+    lon_radar, lat_radar = get_latlon_radar(*rr.shape[1:])
     dtime_radar = time_radar - time_radar[0]
+    time_radar = convert_timezone(time_radar)
 
     return lon_radar, lat_radar, time_radar, dtime_radar, rr
 
 
-def extract_rain_rate_from_radar(
-    lon_bike, lat_bike, dtime_bike, time_radar, lon_radar, lat_radar, dtime_radar, rr
-):
+@functools.lru_cache(maxsize=2)
+def load_radar_rainy(run):
+    """Memory-map the count of rainy frames of a run of the store once per process"""
+    return load_product(run, "rainy")
+
+
+def get_radar_rainy(run, rr, row, col):
+    """
+    Cumulative count over time of the frames with rain of the cell
+    (row, col) of a run (see raw_to_rainy_count), as published with the
+    run or, when it is not available, computed in the same way from the
+    time series of the cell in its cube rr.
     """
-    Given the longitude, latitude and timedelta objects of the radar and of the bike iterate through
-    every point of the bike track and find closest point (in time/space) of the radar data. Then
-    construct the rain_bike array by subsetting the rr array, that is the data from the radar.
+    rainy = None if radar_dir is None else load_radar_rainy(run)
+    if rainy is not None:
+        return rainy[:, row, col]
 
-    Returns a dataframe with the rain rate prediction
+    return raw_to_rainy_count(rr[:, row, col])
+
+
+def rainy_frames_between(dtime_radar, rainy, start, end):
+    """
+    Number of frames with rain in the window [start, end] of time deltas
+    from the first frame, with rainy the cumulative count (see
+    get_radar_rainy) of one or more cells: only two lookups, whatever the
+    length of the window. The frames are looked up by their time delta
+    (see get_radar_data) and not by their local time, which is not
+    increasing when the daylight saving time ends.
+    """
+    i = np.searchsorted(dtime_radar, pd.to_timedelta(start), side="left")
+    j = np.searchsorted(dtime_radar, pd.to_timedelta(end), side="right")
+
+    return rainy[j] - rainy[i]
+
+
+def warm_up():
     """
-    # Construct a BallTree with the coordinate from the radar and look for nearest neighbours
-    # using the list of lat and lon from the track of the bike
-    mytree = BallTree(
-        np.deg2rad(np.dstack([lat_radar, lon_radar])[0]), metric="haversine"
+    Preload the radar run currently served and the radar grid, so that the
+    first request of a worker does not have to pay for it.
+    """
+    if radar_dir is None:
+        return
+    start_time = time.perf_counter()
+    try:
+        run = get_radar_run()
+        if run is None:
+            logging.warning("No radar run published yet, nothing to preload")
+            return
+        get_radar_data(run)
+    except Exception as e:
+        logging.error(f"{type(e).__name__} while preloading radar data: {e}")
+        return
+    logging.info(
+        f"Preloading radar run {run} took {time.perf_counter() - start_time:.2f} seconds"
     )
-    inds_latlon_radar = mytree.query(
-        np.deg2rad(np.vstack([lat_bike, lon_bike]).T), return_distance=False
-    ).ravel()
+
+
+def nearest_time_step(dtime_radar, dtime_bike):
+    """
+    Index of the radar time step closest to every dtime of the bike, the
+    earliest one in case of a tie. dtime_radar must be sorted.
+    """
+    dtime_radar = np.asarray(dtime_radar)
+    dtime_bike = np.asarray(dtime_bike)
+    right = np.clip(np.searchsorted(dtime_radar, dtime_bike), 1, len(dtime_radar) - 1)
+    left = right - 1
+    closer_left = np.abs(dtime_bike - dtime_radar[left]) <= np.abs(
+        dtime_radar[right] - dtime_bike
+    )
+
+    return np.where(closer_left, left, right)
+
+
+def get_route_mapping(lon_bike, lat_bike, dtime_bike, dtime_radar, grid_shape):
+    """
+    Find the closest point (in time/space) of the radar data for every point
+    of the bike track. This only depends on the route and on the radar
+    grid/time steps, not on the radar run, so it can be reused for every run.
+
+    Returns the flat index of the radar cell and the radar time step of every
+    point that has meaningful radar information, together with the mask
+    selecting these points along the track.
+    """
+    # The radar grid is a fixed projection, so the closest grid cell of every
+    # point of the track is computed directly, without searching the grid
+    rows, cols = nearest_cell(lon_bike, lat_bike, *grid_shape)
+    inds_latlon_radar = np.ravel_multi_index((rows, cols), grid_shape)
     # Now find the radar forecast step closest to the dtime for the bike
-    inds_dtime_radar = np.abs(
-        np.subtract.outer(dtime_radar.values, dtime_bike.values)
-    ).argmin(0)
-    # Then finally loop and extract rain rate
-    rain_bike = np.empty(shape=(len(shifts), len(inds_latlon_radar)))
-    for i, shift in enumerate(shifts):
-        temp = []
-        for i_time, i_space in zip(inds_dtime_radar, inds_latlon_radar):
-            if i_time + shift < rr.shape[0]:
-                temp.append(rr[i_time + shift][i_space])
-            else:
-                temp.append(np.nan)
-        rain_bike[i, :] = temp
+    inds_dtime_radar = nearest_time_step(dtime_radar, dtime_bike)
     # We only want points that have meaningful radar information and not duplicates
     # We use a combination of time & space
     id_radar_data = inds_latlon_radar + inds_dtime_radar
     shifted = np.append(id_radar_data[1:], -1)
     # (id_radar_data != shifted) allows us to select the first
     # element of a duplicates sequence
-    rain_bike = rain_bike[:, id_radar_data != shifted]
-    dtime_bike = dtime_bike[id_radar_data != shifted]
-    # Convert from reflectivity to rain rate
-    rain_bike = to_rain_rate(rain_bike)
+    mask = id_radar_data != shifted
 
-    df = convert_to_dataframe(rain_bike, dtime_bike, time_radar)
+    return (
+        inds_latlon_radar[mask].astype(np.int32),
+        inds_dtime_radar[mask].astype(np.int16),
+        mask,
+    )
 
-    return df
+
+@memoize(3600, key_arg="fingerprint")
+def get_cached_route_mapping(fingerprint, lon_bike, lat_bike, dtime_bike, dtime_radar, grid_shape):
+    return get_route_mapping(lon_bike, lat_bike, dtime_bike, dtime_radar, grid_shape)
+
+
+def lookup_route_mapping(lon_bike, lat_bike, dtime_bike, dtime_radar, grid_shape):
+    """
+    The mapping of the route onto the radar grid is reused across runs,
+    so that a new run only needs a gather from the new data
+    """
+    return get_cached_route_mapping(
+        route_fingerprint(lon_bike, lat_bike, dtime_bike, grid_shape, dtime_radar),
+        lon_bike,
+        lat_bike,
+        dtime_bike,
+        dtime_radar,
+        grid_shape,
+    )
+
+
+def subset_radar_data(rr, rows, cols, frames=slice(None), margin=0):
+    """
+    Subset the frames of radar data over the bounding box of the cells
+    (rows, cols), plus margin cells. As the grid is regular this is a
+    slice, so the subset is a view of rr, also when memory-mapped, and not
+    a copy (for a RadarCube, only the frames and rows in the subset are
+    decoded).
+    Returns the subset and the (rows, cols) of the cells in the subset.
+    """
+    r0, r1, c0, c1 = grid_bbox(rows, cols, *rr.shape[1:], margin=margin)
+
+    return rr[frames, r0:r1, c0:c1], (rows - r0, cols - c0)
+
+
+def extract_rain_rate_at_points(lons, lats, rr):
+    """
+    Rain rate time series at the radar cell closest to every point, gathered
+    at once from the bounding box of the points.
+    Returns an array (points, time).
+    """
+    rows, cols = nearest_cell(lons, lats, *rr.shape[1:])
+    subset, (rows, cols) = subset_radar_data(rr, rows, cols)
+
+    return raw_to_rain_rate(subset[:, rows, cols]).T
+
+
+def gather_route(rr, mapping, inds_time):
+    """
+    Raw radar counts at the cells of the route (see get_route_mapping)
+    for the radar time steps inds_time, an array (..., points).
+    Only the bounding box of the route and the frames between the first
+    and the last time step are indexed, see subset_radar_data.
+    """
+    rows, cols = np.divmod(mapping[0], rr.shape[2])
+    t0, t1 = inds_time.min(), inds_time.max() + 1
+    subset, (rows, cols) = subset_radar_data(rr, rows, cols, slice(t0, t1))
+
+    return subset[inds_time - t0, rows, cols]
 
 
-def subset_radar_data(lon_radar, lat_radar, rr, lons, lats, offset=1):
-    """Subset radar data over boundaries defined by bounds
-    bounds = [lon_min, lon_max, lat_min, lat_max]"""
-    lon_min = lons.min() - offset
-    lon_max = lons.max() + offset
-    lat_min = lats.min() - offset
-    lat_max = lats.max() + offset
+def gather_shifts(rr, mapping):
+    """
+    Rain rate (shifts, points) along the route (see get_route_mapping)
+    for all the shifts at once, steps past the end of the forecast are
+    marked as missing.
+    """
+    inds_time = np.add.outer(np.asarray(shifts), mapping[1])
+    missing = inds_time >= rr.shape[0]
+    np.minimum(inds_time, rr.shape[0] - 1, out=inds_time)
+    # Convert from raw counts to rain rate
+    rain_bike = raw_to_rain_rate(gather_route(rr, mapping, inds_time))
+    rain_bike[missing] = np.nan
+
+    return rain_bike
+
 
-    indices = (
-        (lon_radar > (lon_min))
-        & (lon_radar < (lon_max))
-        & (lat_radar > (lat_min))
-        & (lat_radar < (lat_max))
+def extract_rain_rate_batch(routes, time_radar, dtime_radar, rr):
+    """
+    Same as extract_rain_rate_from_radar for many routes, given as a dict
+    id: (lons, lats, dtime), with a single gather from the rr array for
+    all of them. Returns a dict id: dataframe.
+    """
+    mappings = {
+        route_id: lookup_route_mapping(lons, lats, dtime, dtime_radar, rr.shape[1:])
+        for route_id, (lons, lats, dtime) in routes.items()
+    }
+    merged = (
+        np.concatenate([m[0] for m in mappings.values()]),
+        np.concatenate([m[1] for m in mappings.values()]),
+        None,
     )
+    rain = gather_shifts(rr, merged)
+    splits = np.cumsum([len(m[0]) for m in mappings.values()])[:-1]
+
+    return {
+        route_id: convert_to_dataframe(
+            rain_bike, routes[route_id][2][mapping[2]], time_radar
+        )
+        for (route_id, mapping), rain_bike in zip(
+            mappings.items(), np.split(rain, splits, axis=1)
+        )
+    }
+
+
+def extract_rain_rate_from_radar(
+    lon_bike, lat_bike, dtime_bike, time_radar, dtime_radar, rr, mapping=None
+):
+    """
+    Given the longitude, latitude and timedelta objects of the bike and the timedelta of the radar
+    find the closest point (in time/space) of the radar data for every point of the bike track,
+    unless this mapping (see get_route_mapping) is given. Then construct the rain_bike array
+    (shifts, points) by gathering from the rr array, that is the data from the radar.
 
-    return lon_radar[indices], lat_radar[indices], rr[:, indices]
+    Returns a dataframe with the rain rate prediction
+    """
+    if mapping is None:
+        mapping = get_route_mapping(
+            lon_bike, lat_bike, dtime_bike, dtime_radar, rr.shape[1:]
+        )
+    rain_bike = gather_shifts(rr, mapping)
+    dtime_bike = dtime_bike[mapping[2]]
 
+    df = convert_to_dataframe(rain_bike, dtime_bike, time_radar)
 
-@cache.memoize(300)
-def filter_radar_cached(lon_bike, lat_bike):
+    return df
+
+
+def sweep_departures(dtime_bike, time_radar, rr, mapping):
     """
-    Get the radar data and subset it so that we only process
-    the data on the bike trajectory
+    Evaluate every departure allowed by the radar forecast, from now to the
+    last frame minus the duration of the ride, with a single
+    (departures, points) gather from the rr array.
+
+    Returns a dataframe indexed by the departure time with the total rain
+    (mm) and the peak rain rate (mm/h) along the ride for every departure.
+    The dataframe is empty when the ride is longer than the radar forecast,
+    as then no departure has a forecast for the whole ride.
     """
-    lon_radar, lat_radar, time_radar, dtime_radar, rr = get_radar_data()
-    lon_to_plot, lat_to_plot, rain_to_plot = subset_radar_data(
-        lon_radar, lat_radar, rr, lon_bike, lat_bike
+    inds_latlon_radar, inds_dtime_radar, mask = mapping
+    if np.asarray(dtime_bike).max() > time_radar[-1] - time_radar[0]:
+        return pd.DataFrame(
+            {"total": [], "peak": []}, index=time_radar[:0], dtype=float
+        )
+    departures = np.arange(rr.shape[0] - inds_dtime_radar.max())
+    rain_bike = raw_to_rain_rate(
+        gather_route(rr, mapping, np.add.outer(departures, inds_dtime_radar))
+    )
+    # Same scaling to mm as in convert_to_dataframe
+    seconds = pd.TimedeltaIndex(dtime_bike[mask]).seconds
+    difference_hours = np.insert(np.diff(seconds) / 3600.0, 0, 0)
+
+    return pd.DataFrame(
+        {"total": rain_bike @ difference_hours, "peak": rain_bike.max(axis=1)},
+        index=time_radar[departures],
     )
 
-    return lon_to_plot, lat_to_plot, time_radar, dtime_radar, rain_to_plot
+
+def route_fingerprint(lons, lats, dtime, *context):
+    """
+    Key of a route for the caches: a hash of the raw bytes of the
+    coordinates and of the time deltas, together with anything else the
+    cached result depends on (e.g. the radar run).
+    Unlike repr of the arrays it is never truncated and costs a single
+    pass over contiguous buffers.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(lons, dtype=np.float64))
+    h.update(np.ascontiguousarray(lats, dtype=np.float64))
+    h.update(np.ascontiguousarray(dtime, dtype="timedelta64[ns]"))
+    for c in context:
+        if isinstance(c, (np.ndarray, pd.Index)):
+            h.update(np.ascontiguousarray(c))
+        else:
+            h.update(str(c).encode())
+    return h.hexdigest()
 
 
-@cache.memoize(300)
 def get_data(lons, lats, dtime):
-    lon_radar, lat_radar, time_radar, dtime_radar, rr = filter_radar_cached(lons, lats)
+    run = get_radar_run()
+    fingerprint = route_fingerprint(lons, lats, dtime, run)
+
+    return get_route_data(fingerprint, lons, lats, dtime, run=run)
+
+
+@memoize(300, run_arg="run", key_arg="fingerprint")
+def get_route_data(fingerprint, lons, lats, dtime, run):
+    _, _, time_radar, dtime_radar, rr = get_radar_data(run)
+    mapping = lookup_route_mapping(lons, lats, dtime, dtime_radar, rr.shape[1:])
 
     df = extract_rain_rate_from_radar(
         lon_bike=lons,
@@ -343,14 +556,28 @@ def get_data(lons, lats, dtime):
         dtime_bike=dtime,
         time_radar=time_radar,
         dtime_radar=dtime_radar,
-        lat_radar=lat_radar,
-        lon_radar=lon_radar,
         rr=rr,
+        mapping=mapping,
     )
 
     return df
 
 
+def get_departures(lons, lats, dtime):
+    run = get_radar_run()
+    fingerprint = route_fingerprint(lons, lats, dtime, run)
+
+    return get_route_departures(fingerprint, lons, lats, dtime, run=run)
+
+
+@memoize(300, run_arg="run", key_arg="fingerprint")
+def get_route_departures(fingerprint, lons, lats, dtime, run):
+    _, _, time_radar, dtime_radar, rr = get_radar_data(run)
+    mapping = lookup_route_mapping(lons, lats, dtime, dtime_radar, rr.shape[1:])
+
+    return sweep_departures(dtime, time_radar, rr, mapping)
+
+
 def convert_to_dataframe(rain_bike, dtime_bike, time_radar):
     """
     Convert the forecast in a well-formatted dataframe which can then be plotted or converted